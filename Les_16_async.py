@@ -0,0 +1,122 @@
+import asyncio
+from contextlib import asynccontextmanager
+from itertools import islice
+
+
+class AsyncRWLock:
+    # Много читателей или один писатель; ждущий писатель не пропускает новых читателей вперёд
+    def __init__(self):
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        self.condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reading(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writer and not self.waiting_writers)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @asynccontextmanager
+    async def writing(self):
+        async with self.condition:
+            self.waiting_writers += 1
+            try:
+                await self.condition.wait_for(lambda: not self.writer and not self.readers)
+            finally:
+                self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+
+class AsyncCategory:
+    # Асинхронная обёртка над Category: записи и чтения согласуются через AsyncRWLock,
+    # длинные отрисовки и загрузки отдают управление циклу событий каждые chunk_size строк
+    def __init__(self, category, chunk_size=1000):
+        self.category = category
+        self.chunk_size = chunk_size
+        self.lock = AsyncRWLock()
+
+    async def add_product(self, product):
+        async with self.lock.writing():
+            self.category.add_product(product)
+
+    async def set_products(self, products):
+        async with self.lock.writing():
+            self.category.products = products
+
+    async def bulk_load(self, rows, product_cls):
+        # Блокировка писателя берётся на каждую пачку отдельно: хранилище только дополняется,
+        # поэтому читатели между пачками видят согласованный срез и не ждут конца всей загрузки
+        loaded = 0
+        if hasattr(rows, "__aiter__"):
+            batch = []
+            async for row in rows:
+                batch.append(row)
+                if len(batch) >= self.chunk_size:
+                    loaded += await self.load_chunk(batch, product_cls)
+                    batch = []
+            if batch:
+                loaded += await self.load_chunk(batch, product_cls)
+            return loaded
+        rows = iter(rows)
+        while batch := list(islice(rows, self.chunk_size)):
+            loaded += await self.load_chunk(batch, product_cls)
+        return loaded
+
+    async def load_chunk(self, batch, product_cls):
+        async with self.lock.writing():
+            loaded = self.category.bulk_load(batch, product_cls)
+        # Пауза после снятия блокировки даёт ждущим читателям войти раньше следующей пачки
+        await asyncio.sleep(0)
+        return loaded
+
+    async def snapshot(self):
+        async with self.lock.reading():
+            return self.category.snapshot()
+
+    async def iter_products(self):
+        # Блокировка держится только на время снятия среза, сама отрисовка не мешает писателям
+        snapshot = await self.snapshot()
+        for i, line in enumerate(snapshot.iter_products(), 1):
+            yield line
+            if i % self.chunk_size == 0:
+                await asyncio.sleep(0)
+
+    async def products(self):
+        return "".join([line async for line in self.iter_products()])
+
+    async def page(self, number, size=50):
+        async with self.lock.reading():
+            return self.category.page(number, size)
+
+    async def page_after(self, cursor=None, size=50):
+        async with self.lock.reading():
+            return self.category.page_after(cursor, size)
+
+    async def str(self):
+        async with self.lock.reading():
+            return str(self.category)
+
+    async def middle_price(self):
+        async with self.lock.reading():
+            return self.category.middle_price()
+
+    async def find(self, field, value):
+        async with self.lock.reading():
+            return self.category.find(field, value)
+
+    async def find_range(self, field, low=None, high=None):
+        async with self.lock.reading():
+            return self.category.find_range(field, low, high)
@@ -0,0 +1,542 @@
+import argparse
+import contextlib
+import csv
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from Les_16_hmw import BaseProduct, Catalog, Category, IdentityMap, LawnGrass, StringPool, product_events, Product, Smartphone, total_value, value_by_type, value_with_overrides
+from Les_16_io import ingest_file, write_columnar, write_csv, write_jsonl
+from Les_16_parallel import aggregate_categories
+from Les_16_search import ProductSearch
+
+
+def make_smartphone_rows(count):
+    colors = ("Серый", "Черный", "Синий")
+    return [
+        {
+            "name": f"Smartphone {i}",
+            "description": f"{(128, 256, 512)[i % 3]}GB, {colors[i % 3]}",
+            "price": 1000.0 + i % 997,
+            "quantity": 1 + i % 50,
+            "efficiency": "Высокая",
+            "model": f"M{i % 100}",
+            "memory": (128, 256, 512)[i % 3],
+            "color": colors[i % 3]
+        }
+        for i in range(count)
+    ]
+
+
+def make_product_rows(count):
+    return [
+        {"name": f"Product {i}", "description": "Описание", "price": 100.0 + i % 997, "quantity": 1 + i % 50}
+        for i in range(count)
+    ]
+
+
+def make_lawngrass_rows(count):
+    return [
+        {
+            "name": f"Lawn {i}",
+            "description": "Газонная трава",
+            "price": 3000.0 + i % 997,
+            "quantity": 1 + i % 50,
+            "country": ("Россия", "Китай")[i % 2],
+            "germination_period": 5 + i % 10,
+            "color": "Зеленый"
+        }
+        for i in range(count)
+    ]
+
+
+def measure(func, *args):
+    # Вывод конструкторов глушится, чтобы замерять только работу с товарами
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
+
+
+def load_by_loop(rows):
+    category = Category("Смартфоны", "Загрузка по одному товару")
+    for product_data in rows:
+        category.add_product(Smartphone.new_product(product_data))
+    return category
+
+
+def load_in_bulk(rows, columnar=False):
+    category = Category("Смартфоны", "Пакетная загрузка", columnar=columnar)
+    category.bulk_load(rows, Smartphone)
+    return category
+
+
+def bench_bulk_load(count=100000):
+    rows = make_smartphone_rows(count)
+    results = {
+        "loop": measure(load_by_loop, rows),
+        "bulk_load": measure(load_in_bulk, rows),
+        "bulk_load_columnar": measure(load_in_bulk, rows, True)
+    }
+    for name, seconds in results.items():
+        print(f"{name}: {count / seconds:,.0f} строк/с ({seconds:.3f} с)")
+    return results
+
+
+def construct_smartphones(rows):
+    return [Smartphone.new_product(product_data) for product_data in rows]
+
+
+def bench_init_log(count=100000):
+    rows = make_smartphone_rows(count)
+    results = {"print": measure(construct_smartphones, rows)}
+    Smartphone.init_logger = None
+    try:
+        results["off"] = measure(construct_smartphones, rows)
+    finally:
+        del Smartphone.init_logger
+    for name, seconds in results.items():
+        print(f"init_logger={name}: {count / seconds:,.0f} объектов/с ({seconds:.3f} с)")
+    return results
+
+
+def load_baseline(path=None):
+    # Модуль товаров до перехода на __slots__. Без пути он берётся из первого коммита
+    # репозитория, чтобы сравнивать с настоящими классами того времени, а не с их копией
+    if path is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        git = ["git", "-C", root]
+        revision = subprocess.run(git + ["rev-list", "--max-parents=0", "HEAD"],
+                                  capture_output=True, text=True, check=True).stdout.split()[0]
+        source = subprocess.run(git + ["show", f"{revision}:Les_16_hmw.py"],
+                                capture_output=True, text=True, check=True).stdout
+        with tempfile.NamedTemporaryFile("w", suffix=".py", encoding="utf-8", delete=False) as file:
+            file.write(source)
+        try:
+            return load_baseline(file.name)
+        finally:
+            os.remove(file.name)
+    spec = importlib.util.spec_from_file_location("Les_16_hmw_baseline", path)
+    module = importlib.util.module_from_spec(spec)
+    # Первая версия модуля при импорте печатает демонстрацию
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        spec.loader.exec_module(module)
+    return module
+
+
+def instance_size(make, count):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        tracemalloc.start()
+        products = [make() for _ in range(count)]
+        size = tracemalloc.get_traced_memory()[0] - sys.getsizeof(products)
+        tracemalloc.stop()
+    return size / count
+
+
+def bench_memory(count=100000, baseline=None):
+    # Байты на экземпляр без учёта строк и чисел, общих для всех товаров: классы первой
+    # версии с __dict__ (до) рядом с текущими на __slots__ (после), оба через конструктор
+    baseline = load_baseline(baseline)
+    records = {
+        "Product": ("Товар", "Описание", 1000.0, 5),
+        "Smartphone": ("Смартфон", "Описание", 1000.0, 5, "Высокая", "M1", 256, "Серый"),
+        "LawnGrass": ("Трава", "Описание", 1000.0, 5, "Россия", 7, "Зеленый")
+    }
+    current = {"Product": Product, "Smartphone": Smartphone, "LawnGrass": LawnGrass}
+    results = {}
+    for name, record in records.items():
+        before = instance_size(lambda: getattr(baseline, name)(*record), count)
+        after = instance_size(lambda: current[name](*record), count)
+        results[name] = (before, after)
+        print(f"{name}: {before:.1f} байт на экземпляр с __dict__, {after:.1f} с __slots__")
+    return results
+
+
+def value_by_generators(categories):
+    return sum(sum(product.price * product.quantity for product in category._Category__products)
+               for category in categories)
+
+
+def value_by_type_generators(categories):
+    totals = {}
+    for category in categories:
+        for product in category._Category__products:
+            name = type(product).__name__
+            totals[name] = totals.get(name, 0) + product.price * product.quantity
+    return totals
+
+
+def value_with_overrides_generators(categories, price_overrides):
+    return sum(sum(price_overrides.get(product.name, product.price) * product.quantity
+                   for product in category._Category__products)
+               for category in categories)
+
+
+def bench_valuation(category_count=200, per_category=500, columnar=False):
+    rows = make_smartphone_rows(per_category)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        categories = [load_in_bulk(rows, columnar) for _ in range(category_count)]
+    overrides = {"Smartphone 1": 99.0, "Smartphone 7": 5.0}
+    # Индекс по name строится при первом поиске, в замер он не входит
+    for category in categories:
+        category.find("name", None)
+    catalog = Catalog("Каталог", categories)
+    results = {
+        "total_value/generators": measure(value_by_generators, categories),
+        "total_value": measure(total_value, categories),
+        "value_by_type/generators": measure(value_by_type_generators, categories),
+        "value_by_type": measure(value_by_type, categories),
+        "value_with_overrides/generators": measure(value_with_overrides_generators, categories, overrides),
+        "value_with_overrides": measure(value_with_overrides, categories, overrides),
+        "Catalog.total_value": measure(catalog.total_value),
+        "Catalog.value_by_type": measure(catalog.value_by_type)
+    }
+    for name, seconds in results.items():
+        print(f"{name}: {seconds * 1000:.2f} мс")
+    return results
+
+
+def stress_add_product(thread_count=8, per_thread=20000):
+    # Потоки одновременно создают категории и добавляют товары; счётчики должны сойтись точно
+    products = [Product.from_record((f"Товар {i}", "Нагрузочный тест", 10.0, 1)) for i in range(per_thread)]
+    categories_before = Category.category_count
+    products_before = Category.product_count
+    shared = Category("Нагрузка", "Общая категория для всех потоков")
+    start = threading.Barrier(thread_count)
+    categories = []
+
+    def worker():
+        start.wait()
+        category = Category("Нагрузка", "Параллельная загрузка")
+        categories.append(category)
+        for product in products:
+            category.add_product(product)
+            shared.add_product(product)
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert Category.category_count - categories_before == thread_count + 1
+    assert Category.product_count - products_before == 2 * thread_count * per_thread
+    # Итоги каждой категории и обратные ссылки товаров тоже не должны терять обновлений
+    assert len(shared.snapshot()) == shared._quantity_total == thread_count * per_thread
+    for category in categories:
+        assert len(category.snapshot()) == category._quantity_total == per_thread
+    assert all(len(product._categories) == 2 * thread_count for product in products)
+    products[0].price = 20.0
+    assert shared._price_total == thread_count * (per_thread * 1000 + 1000)
+    assert all(category._price_total == per_thread * 1000 + 1000 for category in categories)
+    print(f"Счётчики сошлись: {thread_count} потоков по {per_thread} товаров")
+
+
+def check_product_events():
+    # Пока есть подписчик, товары всех классов должны создаваться, а события - приходить
+    # только по уже собранным товарам
+    changes = []
+    callback = product_events.subscribe(changes.extend)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            products = [Product("Товар", "Описание", 10.0, 1),
+                        Smartphone("Смартфон", "Описание", 1000.0, 2, "Высокая", "M1", 256, "Серый"),
+                        LawnGrass("Трава", "Описание", 300.0, 3, "Россия", 7, "Зеленый"),
+                        Smartphone.new_product(make_smartphone_rows(1)[0]),
+                        LawnGrass.new_product(make_lawngrass_rows(1)[0])]
+        assert not changes
+        products[1].price = 900.0
+        assert [(change.product, change.field, change.new) for change in changes] == [(products[1], "price", 900.0)]
+    finally:
+        product_events.unsubscribe(callback)
+    print("События товаров: создание с подписчиком работает")
+
+
+def bench_validation(count=200000):
+    rows = make_smartphone_rows(count)
+    results = {
+        "validated": measure(Smartphone.records_from_rows, rows),
+        "trusted": measure(Smartphone.records_from_rows, rows, True)
+    }
+    for name, seconds in results.items():
+        print(f"records_from_rows/{name}: {seconds * 10 ** 6 / count:.2f} с на 10^6 строк")
+    return results
+
+
+def bench_aggregate(category_count=2000, per_category=1000):
+    rows = make_smartphone_rows(per_category)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        categories = [load_in_bulk(rows, columnar=columnar) for columnar in (False, True)
+                      for _ in range(category_count // 2)]
+    seconds = measure(aggregate_categories, categories)
+    print(f"aggregate_categories, {len(categories)} категорий по {per_category} товаров: {seconds:.4f} с")
+    return seconds
+
+
+def sort_top(category, k, by):
+    return sorted(category._Category__products, key=lambda product: getattr(product, by), reverse=True)[:k]
+
+
+def bench_top(count=1000000, k=10):
+    rows = make_smartphone_rows(count)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        category = load_in_bulk(rows)
+    results = {
+        "sorted": measure(sort_top, category, k, "price"),
+        "top/heap": measure(category.top, k, "price")
+    }
+    # Отсортированный индекс строится один раз, дальше он поддерживается add_product и событиями товаров
+    list(category.sorted_view("price"))
+    results["top/sorted_view"] = measure(category.top, k, "price")
+    for name, seconds in results.items():
+        print(f"{name}: {seconds * 1000:.3f} мс")
+    return results
+
+
+def bench_ingest(count=200000):
+    # Файлы пишутся построчно, чтобы и сам замер не держал все строки в памяти
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        jsonl_path = os.path.join(directory, "products.jsonl")
+        csv_path = os.path.join(directory, "products.csv")
+        columns = ["type"] + list(Smartphone.fields)
+        with open(jsonl_path, "w", encoding="utf-8") as jsonl_file, \
+                open(csv_path, "w", encoding="utf-8", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(columns)
+            for start in range(0, count, 10000):
+                for row in make_smartphone_rows(min(10000, count - start)):
+                    jsonl_file.write(json.dumps({"type": "Smartphone", **row}, ensure_ascii=False) + "\n")
+                    writer.writerow(["Smartphone"] + [row[field] for field in Smartphone.fields])
+        for path in (jsonl_path, csv_path):
+            category = Category("Смартфоны", "Потоковая загрузка", columnar=True)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                stats = ingest_file(category, path)
+            results[os.path.basename(path)] = stats
+            print(f"{os.path.basename(path)}: {stats.rows_per_second:,.0f} строк/с, пик RSS {stats.peak_rss} КБ")
+    return results
+
+
+def bench_export(count=1000000):
+    rows = make_smartphone_rows(count)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        category = load_in_bulk(rows, columnar=True)
+    del rows
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, writer in (("jsonl", write_jsonl), ("csv", write_csv), ("l16c", write_columnar)):
+            path = os.path.join(directory, f"products.{name}")
+            results[name] = measure(writer, category, path)
+            print(f"{name}: {count / results[name]:,.0f} строк/с, {os.path.getsize(path) / count:.1f} байт на строку")
+    return results
+
+
+def bench_search(count=1000000, repeat=50):
+    rows = make_smartphone_rows(count)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        category = load_in_bulk(rows, columnar=True)
+    del rows
+    queries = ("smartphone 256gb", "серый", "m42", "smartphon", "синий 512gb m7", "smartfone", "Smartphone 4217")
+    latencies = []
+    with ProductSearch([category]) as search:
+        build = measure(search.sync)
+        # Запросы ничего не печатают, поэтому замеряются без measure() и его перенаправления вывода
+        for query in queries * repeat:
+            start = time.perf_counter()
+            search.search(query)
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"Индекс: {build:.1f} с, p99 запроса: {p99 * 1000:.3f} мс")
+    return {"build": build, "p99": p99}
+
+
+def bench_identity_map(category_count=20, per_category=5000):
+    # Одни и те же строки загружаются в каждую категорию через new_product
+    rows = make_smartphone_rows(per_category)
+    results = {}
+    for name, identity_map in (("off", None), ("on", IdentityMap())):
+        BaseProduct.identity_map = identity_map
+        try:
+            tracemalloc.start()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                categories = [Category("Смартфоны", "Общие SKU", construct_smartphones(rows))
+                              for _ in range(category_count)]
+            results[name] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+        finally:
+            BaseProduct.identity_map = None
+        print(f"identity_map={name}: {results[name] / 2 ** 20:.1f} МБ, "
+              f"total_value={total_value(categories)}, уникальных={total_value(categories, unique=True)}")
+    return results
+
+
+def bench_flyweight(count=1000000, chunk=10000):
+    # Строки проходят через JSON, как при загрузке из файла: у каждой строки свои объекты str,
+    # и без пула одинаковые цвета, модели и страны хранятся в памяти по отдельности
+    results = {}
+    original = BaseProduct.string_pool
+    for name, pool in (("off", None), ("on", StringPool())):
+        BaseProduct.string_pool = pool
+        try:
+            tracemalloc.start()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                categories = [Category("Смартфоны", "Синтетический каталог"),
+                              Category("Смартфоны", "Синтетический каталог", columnar=True)]
+                for start in range(0, count, chunk):
+                    rows = json.loads(json.dumps(make_smartphone_rows(chunk)))
+                    for category in categories:
+                        category.bulk_load(rows, Smartphone)
+                    del rows
+            results[name] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+        finally:
+            BaseProduct.string_pool = original
+        del categories
+        print(f"string_pool={name}: {results[name] / 2 ** 20:.1f} МБ на {count:,} товаров"
+              f" ({results[name] / count:.0f} байт на товар в двух категориях)")
+    print(f"Экономия: {(results['off'] - results['on']) / 2 ** 20:.1f} МБ")
+    return results
+
+
+SUITE_SIZES = (10, 1000, 100000, 1000000)
+
+
+def best_time(func, setup=None, repeat=3, number=1):
+    # Лучшее из repeat замеров, в секундах на один вызов; setup выполняется вне замера
+    best = None
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+
+        def run():
+            for _ in range(number):
+                func(*args)
+
+        seconds = measure(run) / number
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def build_category(products):
+    category = Category("Смартфоны", "Набор для замеров")
+    for product in products:
+        category.add_product(product)
+    return category
+
+
+def reprice(products):
+    # Смена цены товара из категории: проверка, итоги и версия категории на каждый товар
+    for product in products:
+        product.price = product.price + 1
+
+
+def run_suite(sizes=SUITE_SIZES):
+    results = {}
+    for size in sizes:
+        repeat = 3 if size <= 100000 else 1
+        product_rows = make_product_rows(size)
+        smartphone_rows = make_smartphone_rows(size)
+        lawngrass_rows = make_lawngrass_rows(size)
+
+        def new_smartphones():
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                return [Smartphone.new_product(product_data) for product_data in smartphone_rows]
+
+        products = new_smartphones()
+        category = build_category(products)
+        category.products
+        timings = {
+            "Product.new_product": best_time(
+                lambda: [Product.new_product(product_data) for product_data in product_rows], repeat=repeat),
+            "Smartphone()": best_time(
+                lambda: [Smartphone(**product_data) for product_data in smartphone_rows], repeat=repeat),
+            "LawnGrass()": best_time(
+                lambda: [LawnGrass(**product_data) for product_data in lawngrass_rows], repeat=repeat),
+            "Category.add_product": best_time(lambda: build_category(products), repeat=repeat),
+            "Product.price=": best_time(lambda: reprice(products), repeat=repeat),
+            "Category.products": best_time(
+                lambda fresh: fresh.products, setup=lambda: build_category(new_smartphones()), repeat=repeat),
+            "Category.products/cached": best_time(lambda: category.products, number=1000),
+            "Category.__str__": best_time(lambda: str(category), number=1000),
+            "Category.__add__": best_time(lambda: category + category, number=1000),
+            "Category.middle_price": best_time(category.middle_price, number=1000)
+        }
+        for name, seconds in timings.items():
+            results.setdefault(name, {})[str(size)] = seconds
+            print(f"{name} [{size}]: {seconds * 1000:.4f} мс")
+    return {
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sizes": list(sizes),
+        "results": results
+    }
+
+
+def compare_results(old, new, tolerance=1.2):
+    # Регрессия - операция стала медленнее старой более чем в tolerance раз
+    regressions = []
+    for name, timings in new["results"].items():
+        for size, seconds in timings.items():
+            old_seconds = old["results"].get(name, {}).get(size)
+            if not old_seconds:
+                continue
+            ratio = seconds / old_seconds
+            print(f"{name} [{size}]: {ratio:.2f}x")
+            if ratio > tolerance:
+                regressions.append((name, int(size), ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры Product/Category")
+    commands = parser.add_subparsers(dest="command")
+    suite = commands.add_parser("suite", help="полный набор замеров с сохранением в JSON")
+    suite.add_argument("--sizes", type=int, nargs="+", default=list(SUITE_SIZES))
+    suite.add_argument("--output", default="bench_results.json")
+    compare = commands.add_parser("compare", help="сравнение двух JSON с результатами")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--tolerance", type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    if args.command == "suite":
+        report = run_suite(args.sizes)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    elif args.command == "compare":
+        with open(args.old, encoding="utf-8") as file:
+            old = json.load(file)
+        with open(args.new, encoding="utf-8") as file:
+            new = json.load(file)
+        regressions = compare_results(old, new, args.tolerance)
+        for name, size, ratio in regressions:
+            print(f"Регрессия: {name} [{size}] медленнее в {ratio:.2f} раза")
+        return 1 if regressions else 0
+    else:
+        bench_bulk_load()
+        bench_init_log()
+        bench_memory()
+        bench_valuation()
+        bench_valuation(columnar=True)
+        stress_add_product()
+        check_product_events()
+        bench_aggregate()
+        bench_validation()
+        bench_top()
+        bench_ingest()
+        bench_export()
+        bench_search()
+        bench_identity_map()
+        bench_flyweight()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
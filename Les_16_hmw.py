@@ -1,34 +1,410 @@
 from abc import ABC, abstractmethod
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
+from itertools import chain, islice
+from operator import attrgetter, itemgetter, mul
+import heapq
+import queue
+import sys
+import threading
+import weakref
+
+MISSING = object()
+
+
+def to_kopecks(price):
+    # Деньги считаются в целых копейках: float-цена округляется до копейки
+    return price * 100 if type(price) is int else round(price * 100)
+
+
+def money(price):
+    # Цена для хранения и вывода: int остаётся int, float обрезается до целых копеек.
+    # Цена, уже кратная копейке, возвращается тем же объектом: новый float на каждый товар
+    # стоил бы 24 байта сверх раскладки на __slots__
+    if type(price) is int:
+        return price
+    rounded = round(price * 100) / 100
+    return price if rounded == price else rounded
+
+
+def money_record(record):
+    # Запись товара с ценой, округлённой до копеек: проверка "> 0" видит то же значение,
+    # что потом хранится, и 0.004 не превращается после проверки в 0.0
+    if type(record[2]) is float:
+        return record[:2] + (money(record[2]),) + record[3:]
+    return record
+
+
+def exact_total(prices, quantities=None):
+    # Точная сумма в копейках - обычное целое число, без Fraction и накопления ошибок float
+    kopecks = map(to_kopecks, prices)
+    if quantities is not None:
+        kopecks = map(mul, kopecks, quantities)
+    return sum(kopecks)
+
+
+def as_number(total, has_float):
+    # total в копейках; деление int на int в Python округляется верно
+    return total / 100 if has_float else total // 100
+
+
+def format_init_args(class_name, args):
+    params = ', '.join([f"'{arg}'" if isinstance(arg, str) else str(arg) for arg in args])
+    return f"{class_name}({params})"
+
+
+def print_init_log(class_name, args):
+    print(format_init_args(class_name, args))
+
+
+class SampledInitLog:
+    # Пишет только каждое every-е создание объекта
+    def __init__(self, every, sink=print_init_log):
+        self.every = every
+        self.sink = sink
+        self.seen = 0
+
+    def __call__(self, class_name, args):
+        self.seen += 1
+        if self.seen % self.every == 0:
+            self.sink(class_name, args)
+
+
+class BufferedInitLog:
+    # Складывает аргументы в ограниченную очередь, строки форматирует и пишет фоновый поток.
+    # При переполнении очереди записи отбрасываются и учитываются в dropped
+    def __init__(self, maxsize=10000, stream=None):
+        self.stream = stream
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self.__drain, daemon=True)
+        self.thread.start()
+
+    def __call__(self, class_name, args):
+        try:
+            self.queue.put_nowait((class_name, args))
+        except queue.Full:
+            self.dropped += 1
+
+    def __drain(self):
+        while True:
+            item = self.queue.get()
+            if item is not None:
+                print(format_init_args(*item), file=self.stream or sys.stdout)
+            self.queue.task_done()
+            if item is None:
+                break
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
 
 
 class InitPrintMixin:
+    __slots__ = ()
+    # None отключает лог; настраивается отдельно для каждого класса (Product, Smartphone, LawnGrass)
+    init_logger = print_init_log
+
     def __init_print__(self, *args):
-        class_name = self.__class__.__name__
-        params = ', '.join([f"'{arg}'" if isinstance(arg, str) else str(arg) for arg in args])
-        print(f"{class_name}({params})")
+        logger = type(self).init_logger
+        if logger is not None:
+            logger(type(self).__name__, args)
+
+
+ProductChange = namedtuple("ProductChange", "product field old new")
+ValidationError = namedtuple("ValidationError", "row field message")
+Page = namedtuple("Page", "products text cursor has_more")
+
+RANGE_MESSAGES = {
+    "price": "Цена не должна быть нулевая или отрицательная",
+    "quantity": "Товар с нулевым количеством не может быть добавлен"
+}
+# Обратные ссылки товара могут менять сразу несколько категорий из разных потоков. Блокировка
+# выбирается по id товара из небольшого набора: свой замок на каждый товар стоил бы памяти,
+# а один общий снова сводил бы все add_product в одну очередь
+_back_refs_locks = tuple(threading.Lock() for _ in range(64))
+
+
+def back_refs_lock(product):
+    return _back_refs_locks[(id(product) >> 4) % len(_back_refs_locks)]
+
+
+class EventsState(threading.local):
+    # Состояние batch() своего потока. Значения по умолчанию заданы в классе: getattr с
+    # умолчанием на threading.local без атрибута заметно дороже, а он стоит на каждом
+    # add_product и каждой смене цены
+    depth = 0
+    pending = None
+
+
+class ProductEvents:
+    # Поток изменений полей товаров. Категории-владельцы получают изменения всегда,
+    # остальные подписчики - списками ProductChange. Внутри batch() изменения копятся и сливаются:
+    # для товара и поля остаётся первое старое и последнее новое значение
+    def __init__(self):
+        self.subscribers = []
+        self.local = EventsState()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    @contextmanager
+    def batch(self):
+        local = self.local
+        local.depth += 1
+        if local.depth == 1:
+            local.pending = {}
+        try:
+            yield
+        finally:
+            local.depth -= 1
+            if local.depth == 0:
+                self.flush()
+
+    def publish(self, product, field, old, new):
+        if not self.local.depth:
+            # Одиночное изменение вне batch() не нужно сливать и упорядочивать
+            if old != new:
+                quantity = product._quantity if field == "price" else None
+                for category in product._owners():
+                    category._field_changed(product, field, old, new, quantity)
+                for callback in list(self.subscribers):
+                    callback([ProductChange(product, field, old, new)])
+            return
+        # Итоги догонят при flush(), а закешированные строки категорий должны сброситься сразу
+        for category in product._owners():
+            category._rendered = None
+        key = (id(product), field)
+        change = self.local.pending.get(key)
+        if change is None:
+            self.local.pending[key] = [product, field, old, new]
+        else:
+            change[3] = new
+
+    def flush(self):
+        # Вызывается и перед сменой состава категорий, чтобы дельты ушли прежним владельцам
+        pending = self.local.pending
+        if pending:
+            self.local.pending = {}
+            self.deliver(list(pending.values()))
+
+    def deliver(self, changes):
+        changes = [change for change in changes if change[2] != change[3]]
+        changes.sort(key=lambda change: change[1] != "price")
+        # Дельта цены считается по остатку до пачки, дельта остатка - по новой цене,
+        # тогда вместе они дают ровно new_price * new_quantity - old_price * old_quantity
+        old_quantities = {id(product): old for product, field, old, new in changes if field == "quantity"}
+        for product, field, old, new in changes:
+            quantity = old_quantities.get(id(product), product.quantity) if field == "price" else None
+            for category in product._owners():
+                category._field_changed(product, field, old, new, quantity)
+        if changes and self.subscribers:
+            events = [ProductChange(*change) for change in changes]
+            for callback in list(self.subscribers):
+                callback(events)
+
+
+product_events = ProductEvents()
+
+
+class StringPool:
+    # Приспособленец для повторяющихся строк: каждое различное значение хранится один раз,
+    # товары ссылаются на общую копию. Пул рассчитан на поля с небольшим числом значений:
+    # заполнив maxsize, он перестаёт расти и отдаёт новые строки как есть; clear() освобождает его
+    def __init__(self, maxsize=1 << 16):
+        self.maxsize = maxsize
+        self.values = {}
+
+    def intern(self, value):
+        if type(value) is not str:
+            return value
+        pooled = self.values.get(value)
+        if pooled is None:
+            if len(self.values) >= self.maxsize:
+                return value
+            pooled = self.values[value] = value
+        return pooled
+
+    def intern_record(self, record, positions):
+        record = list(record)
+        values = self.values
+        for i in positions:
+            # Уже известная строка берётся из пула без вызова intern()
+            value = record[i]
+            if type(value) is str:
+                pooled = values.get(value)
+                record[i] = self.intern(value) if pooled is None else pooled
+        return record
+
+    def clear(self):
+        self.values.clear()
+
+    def __len__(self):
+        return len(self.values)
+
+
+def sku(cls, record):
+    # Ключ товара: класс и значения всех полей. Тип цены входит в ключ, потому что 1000 и 1000.0
+    # равны, но выводятся по-разному
+    return cls, record, type(record[2])
+
+
+class IdentityMap:
+    # Общие экземпляры товаров по SKU: одинаковые словари в new_product дают один объект.
+    # Если общий товар потом изменили, старый ключ ему больше не соответствует и создаётся новый
+    def __init__(self):
+        self.products = {}
+        self.lock = threading.Lock()
+
+    def get(self, cls, products):
+        try:
+            record = tuple(products[field] for field in cls.fields)
+        except KeyError:
+            return cls(**products)
+        # Товар хранит цену, округлённую до копеек, поэтому ключ и сравнение идут по ней же
+        record = money_record(record)
+        key = sku(cls, record)
+        with self.lock:
+            product = self.products.get(key)
+            if product is None or tuple(getattr(product, field) for field in cls.fields) != record:
+                product = self.products[key] = cls(**products)
+            return product
+
+    def __len__(self):
+        return len(self.products)
+
+    def clear(self):
+        with self.lock:
+            self.products.clear()
+
+
+def field_property(field):
+    # Видимое поле товара: значение лежит в слоте "_" + field, чтение идёт напрямую через attrgetter,
+    # а запись через свойство проверяется по field_rules, сбрасывает закешированные строки
+    # и публикует изменение. Конструкторы и from_record пишут в слоты сами и этот путь не проходят
+    slot = "_" + field
+
+    def set_field(self, value):
+        self._set_field(field, slot, value)
+
+    return property(attrgetter(slot), set_field)
 
 
 class BaseProduct(ABC):
+    # __weakref__ оставлен, чтобы на товары можно было держать слабые ссылки (кеши, WeakSet)
+    __slots__ = ("_categories", "_render", "_name", "_description", "_price", "_quantity", "__weakref__")
+    extra_fields = ()
+    fields = ("name", "description", "price", "quantity")
+    record_slots = ("_name", "_description", "_price", "_quantity")
+    # IdentityMap для new_product; None - каждый вызов создаёт новый объект
+    identity_map = None
+    # Поля с небольшим числом различных значений хранятся через string_pool; None отключает пул.
+    # Название и описание почти у каждого товара свои, поэтому в пул не попадают
+    interned_fields = ()
+    interned_positions = ()
+    string_pool = StringPool()
+    # Поле: (допустимые типы, должно ли значение быть положительным)
+    field_rules = {
+        "name": ((str,), False),
+        "description": ((str,), False),
+        "price": ((int, float), True),
+        "quantity": ((int,), True)
+    }
+
     def __init__(self, name, description, price, quantity):
-        if quantity <= 0:
-            raise ValueError("Товар с нулевым количеством не может быть добавлен")
+        # Поля наследников (Smartphone, LawnGrass) к этому моменту уже заполнены
+        cls = type(self)
+        if type(price) is float:
+            price = money(price)
+        record = (name, description, price, quantity)
+        if cls.extra_fields:
+            record += tuple([getattr(self, slot) for slot in cls.record_slots[4:]])
+        errors = cls.record_errors(record)
+        if errors:
+            field, message, error = errors[0]
+            raise error(message)
 
-        self.name = name
-        self.description = description
-        self._price = price
-        self.quantity = quantity
+        self._render = None
+        if cls.string_pool is not None and cls.interned_positions:
+            record = cls.string_pool.intern_record(record, cls.interned_positions)
+            for i in cls.interned_positions:
+                if i >= len(BaseProduct.fields):
+                    setattr(self, cls.record_slots[i], record[i])
+        self._name = name
+        self._description = record[1]
+        self._price = record[2]
+        self._quantity = quantity
+        self._categories = ()
         super().__init__()
 
+    name = field_property("name")
+    description = field_property("description")
+
     @property
     def price(self):
         return self._price
 
     @price.setter
     def price(self, value):
-        if value <= 0:
-            print("Цена не должна быть нулевая или отрицательная")
-        else:
-            self._price = value
+        if type(value) is float:
+            value = round(value * 100) / 100
+        self._set_field("price", "_price", value)
+
+    @property
+    def quantity(self):
+        return self._quantity
+
+    @quantity.setter
+    def quantity(self, value):
+        self._set_field("quantity", "_quantity", value)
+
+    def _set_field(self, field, slot, value):
+        # Недопустимое значение не записывается: TypeError/ValueError, как и в конструкторе.
+        # Изменение видимого поля сразу сбрасывает закешированные строки,
+        # а итоги и индексы категорий обновляются через поток событий product_events
+        types, positive = self.field_rules[field]
+        if type(value) not in types or positive and value <= 0:
+            message, exception = self.field_error(field, value)
+            raise exception(message)
+        old = getattr(self, slot)
+        setattr(self, slot, value)
+        self._render = None
+        if product_events.subscribers or product_events.local.depth:
+            product_events.publish(self, field, old, value)
+        elif self._categories and old != value:
+            # Одиночное изменение без подписчиков - самый частый случай: владельцы получают его
+            # напрямую, без publish(); _owners() нужен, только чтобы вычистить мёртвые ссылки
+            quantity = self._quantity if field == "price" else None
+            for ref in self._categories:
+                category = ref()
+                if category is None:
+                    self._owners()
+                else:
+                    category._field_changed(self, field, old, value, quantity)
+
+    def _owners(self):
+        # Товар знает свои категории по слабым ссылкам, поэтому не удерживает в памяти
+        # выброшенные категории; ссылки на уже удалённые вычищаются при обходе
+        owners = [ref() for ref in self._categories]
+        if None in owners:
+            with back_refs_lock(self):
+                self._categories = tuple(ref for ref in self._categories if ref() is not None)
+            owners = [category for category in owners if category is not None]
+        return owners
+
+    def rendered(self):
+        if self._render is None:
+            self._render = str(self)
+        return self._render
 
     @abstractmethod
     def __str__(self):
@@ -39,23 +415,101 @@ class BaseProduct(ABC):
     def new_product(cls, products):
         pass
 
+    @classmethod
+    def from_dict(cls, products):
+        if cls.identity_map is None:
+            return cls(**products)
+        return cls.identity_map.get(cls, products)
+
+    @classmethod
+    def field_error(cls, field, value):
+        # Единственная проверка поля по field_rules: (сообщение, тип исключения) или None
+        types, positive = cls.field_rules[field]
+        if type(value) not in types:
+            return f"Поле {field} должно иметь тип {' или '.join(t.__name__ for t in types)}", TypeError
+        if positive and value <= 0:
+            return RANGE_MESSAGES.get(field, f"Поле {field} должно быть положительным"), ValueError
+        return None
+
+    @classmethod
+    def record_errors(cls, record):
+        # Ошибки записи списком (поле, сообщение, тип исключения); пустой список - запись верна.
+        # Верные поля проверяются прямо здесь, field_error вызывается только ради сообщения
+        errors = []
+        rules = cls.field_rules
+        for field, value in zip(cls.fields, record):
+            types, positive = rules[field]
+            if type(value) not in types or positive and value <= 0:
+                errors.append((field,) + cls.field_error(field, value))
+        return errors
+
+    @classmethod
+    def records_from_rows(cls, rows, trusted=False, report=None, start=0):
+        # Проверка пачки словарей целиком до создания объектов. trusted пропускает проверку
+        # типов и диапазонов; с report ошибочные строки не прерывают загрузку, а попадают в отчёт
+        fields = cls.fields
+        get_record = itemgetter(*fields)
+        if trusted and report is None:
+            try:
+                return list(map(get_record, rows))
+            except KeyError:
+                raise TypeError(f"Ожидаются поля {', '.join(fields)} для {cls.__name__}") from None
+        check = cls.record_errors
+        records = []
+        for row_number, row in enumerate(rows, start):
+            try:
+                if len(row) != len(fields):
+                    raise KeyError
+                record = money_record(get_record(row))
+            except KeyError:
+                errors = [(None, f"Ожидаются поля {', '.join(fields)} для {cls.__name__}", TypeError)]
+            else:
+                errors = () if trusted else check(record)
+            if not errors:
+                records.append(record)
+            elif report is None:
+                field, message, error = errors[0]
+                raise error(message)
+            else:
+                report.extend(ValidationError(row_number, field, message) for field, message, _ in errors)
+        return records
+
+    @classmethod
+    def from_record(cls, record):
+        product = cls.__new__(cls)
+        set_slot = object.__setattr__
+        set_slot(product, "_categories", ())
+        set_slot(product, "_render", None)
+        if cls.string_pool is not None and cls.interned_positions:
+            record = cls.string_pool.intern_record(record, cls.interned_positions)
+        for slot, value in zip(cls.record_slots, record):
+            set_slot(product, slot, value)
+        set_slot(product, "_price", money(product._price))
+        return product
+
     def __len__(self):
         return self.quantity
 
+    @property
+    def stock_value(self):
+        return self.price * self.quantity
+
     def __add__(self, other):
         if type(self) is type(other):
-            return self.price * self.quantity + other.price * other.quantity
+            return stock_value((self, other))
         raise TypeError("Ошибка сложения. Нельзя складывать не экземпляры одного класса")
 
 
 class Product(BaseProduct, InitPrintMixin):
+    __slots__ = ()
+
     def __init__(self, name, description, price, quantity):
         super().__init__(name, description, price, quantity)
         self.__init_print__(name, description, price, quantity)
 
     @classmethod
     def new_product(cls, products):
-        return cls(**products)
+        return cls.from_dict(products)
 
     def __str__(self):
         return f"{self.name}, {self.price} руб. Остаток: {self.quantity} шт."
@@ -65,16 +519,35 @@ class Product(BaseProduct, InitPrintMixin):
 
 
 class Smartphone(Product):
+    extra_fields = ("efficiency", "model", "memory", "color")
+    __slots__ = tuple("_" + field for field in extra_fields)
+    fields = BaseProduct.fields + extra_fields
+    field_rules = {
+        **BaseProduct.field_rules,
+        "efficiency": ((str,), False),
+        "model": ((str,), False),
+        "memory": ((int,), True),
+        "color": ((str,), False)
+    }
+    record_slots = BaseProduct.record_slots + __slots__
+    interned_fields = BaseProduct.interned_fields + ("efficiency", "model", "color")
+    interned_positions = tuple(map(fields.index, interned_fields))
+
+    efficiency = field_property("efficiency")
+    model = field_property("model")
+    memory = field_property("memory")
+    color = field_property("color")
+
     def __init__(self, name, description, price, quantity, efficiency, model, memory, color):
-        self.efficiency = efficiency
-        self.model = model
-        self.memory = memory
-        self.color = color
+        self._efficiency = efficiency
+        self._model = model
+        self._memory = memory
+        self._color = color
         super().__init__(name, description, price, quantity)
 
     @classmethod
     def new_product(cls, products):
-        return cls(**products)
+        return cls.from_dict(products)
 
     def __str__(self):
         return f"{self.name} {self.model}, {self.price} руб. Остаток: {self.quantity} шт. (Цвет: {self.color}, Память: {self.memory}GB, Эффективность: {self.efficiency})"
@@ -84,15 +557,32 @@ class Smartphone(Product):
 
 
 class LawnGrass(Product):
+    extra_fields = ("country", "germination_period", "color")
+    __slots__ = tuple("_" + field for field in extra_fields)
+    fields = BaseProduct.fields + extra_fields
+    field_rules = {
+        **BaseProduct.field_rules,
+        "country": ((str,), False),
+        "germination_period": ((int,), True),
+        "color": ((str,), False)
+    }
+    record_slots = BaseProduct.record_slots + __slots__
+    interned_fields = BaseProduct.interned_fields + ("country", "color")
+    interned_positions = tuple(map(fields.index, interned_fields))
+
+    country = field_property("country")
+    germination_period = field_property("germination_period")
+    color = field_property("color")
+
     def __init__(self, name, description, price, quantity, country, germination_period, color):
-        self.country = country
-        self.germination_period = germination_period
-        self.color = color
+        self._country = country
+        self._germination_period = germination_period
+        self._color = color
         super().__init__(name, description, price, quantity)
 
     @classmethod
     def new_product(cls, products):
-        return cls(**products)
+        return cls.from_dict(products)
 
     def __str__(self):
         return f"{self.name}, {self.price} руб. Остаток: {self.quantity} шт. (Цвет: {self.color}, Страна: {self.country}, Срок прорастания: {self.germination_period} дней)"
@@ -101,51 +591,608 @@ class LawnGrass(Product):
         return f"LawnGrass('{self.name}', '{self.description}', {self.price}, {self.quantity}, '{self.country}', {self.germination_period}, '{self.color}')"
 
 
-class Category:
-    category_count = 0
-    product_count = 0
+class ProductColumns:
+    # Колоночное хранение товаров: цены и остатки лежат в непрерывных массивах,
+    # строки интернируются, а объекты товаров собираются только при обращении.
+    # Наборы доп. полей повторяются, поэтому у товара хранится только их код
+    def __init__(self, products=None):
+        self.classes = []
+        self.class_codes = array('B')
+        self.names = []
+        self.descriptions = []
+        # Цены в копейках; int_prices помнит, выводить цену как int или как float
+        self.prices = array('q')
+        self.int_prices = array('B')
+        self.quantities = array('q')
+        self.extra_codes = array('I')
+        self.extras = [None]
+        self._extras_pool = {None: 0}
+        for product in products or []:
+            self.append(product)
+
+    def append(self, product):
+        cls = type(product)
+        self.append_record(cls, (product.name, product.description, product.price, product.quantity)
+                           + tuple(getattr(product, field) for field in cls.extra_fields))
+
+    def append_record(self, cls, record):
+        if cls not in self.classes:
+            self.classes.append(cls)
+        self.class_codes.append(self.classes.index(cls))
+        self.names.append(sys.intern(record[0]))
+        self.descriptions.append(record[1])
+        self.prices.append(to_kopecks(record[2]))
+        self.int_prices.append(isinstance(record[2], int))
+        self.quantities.append(record[3])
+        self.extra_codes.append(self.__code(self.extras, self._extras_pool, record[4:] or None))
+
+    @staticmethod
+    def __code(values, pool, value):
+        code = pool.get(value)
+        if code is None:
+            code = pool[value] = len(values)
+            values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.prices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.materialize(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Индекс товара вне диапазона")
+        return self.materialize(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.materialize(i)
+
+    def price_at(self, index):
+        kopecks = self.prices[index]
+        return kopecks // 100 if self.int_prices[index] else kopecks / 100
+
+    def record_at(self, index):
+        # price_at вызывается явно: наследники (снимок на диске) сдвигают в нём индекс
+        cls = self.classes[self.class_codes[index]]
+        return cls, (self.names[index], self.descriptions[index],
+                     ProductColumns.price_at(self, index),
+                     self.quantities[index]) + (self.extras[self.extra_codes[index]] or ())
+
+    def materialize(self, index):
+        cls, record = self.record_at(index)
+        return cls.from_record(record)
+
+    def value_at(self, index, field):
+        if field == "name":
+            return self.names[index]
+        if field == "description":
+            return self.descriptions[index]
+        if field == "price":
+            return ProductColumns.price_at(self, index)
+        if field == "quantity":
+            return self.quantities[index]
+        extra_fields = self.classes[self.class_codes[index]].extra_fields
+        if field in extra_fields:
+            return self.extras[self.extra_codes[index]][extra_fields.index(field)]
+        return MISSING
+
+
+class HashIndex:
+    def __init__(self):
+        self.buckets = {}
+
+    def add(self, key, position):
+        self.buckets.setdefault(key, []).append(position)
+
+    def extend(self, items):
+        for key, position in items:
+            self.buckets.setdefault(key, []).append(position)
+
+    def remove(self, key, position):
+        bucket = self.buckets[key]
+        bucket.remove(position)
+        if not bucket:
+            del self.buckets[key]
+
+    def find(self, key):
+        return list(self.buckets.get(key, ()))
+
+
+class SortedIndex:
+    # Ключи и позиции товаров хранятся в двух параллельных отсортированных списках
+    def __init__(self):
+        self.keys = []
+        self.positions = []
+
+    def add(self, key, position):
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.positions.insert(i, position)
+
+    def extend(self, items):
+        # Пары (ключ, позиция) вливаются одной сортировкой, а не вставкой по одной (O(n^2)).
+        # Индекс уже отсортирован, и сортировка Python сливает готовые серии почти за линейное время;
+        # она устойчива, поэтому при равных ключах новые позиции встают после прежних, как в add
+        items = sorted(chain(zip(self.keys, self.positions), items), key=itemgetter(0))
+        self.keys = [key for key, _ in items]
+        self.positions = [position for _, position in items]
+
+    def remove(self, key, position):
+        i = bisect_left(self.keys, key)
+        while self.positions[i] != position:
+            i += 1
+        del self.keys[i]
+        del self.positions[i]
+
+    def find(self, key):
+        return self.range(key, key)
+
+    def range(self, low=None, high=None):
+        start = 0 if low is None else bisect_left(self.keys, low)
+        stop = len(self.keys) if high is None else bisect_right(self.keys, high)
+        return self.positions[start:stop]
+
+
+class ShardedCounter:
+    # Каждый поток увеличивает только свой счётчик, поэтому += не теряет обновления;
+    # значение собирается суммой по всем потокам при чтении. Счётчики завершившихся потоков
+    # переносятся в base, чтобы список не рос с каждым короткоживущим потоком
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()
+        self.base = 0
+
+    def add(self, value):
+        try:
+            self.local.shard[0] += value
+        except AttributeError:
+            # Первое увеличение в этом потоке регистрирует его счётчик
+            shard = self.local.shard = [value]
+            with self.lock:
+                self.__retire()
+                self.shards.append((threading.current_thread(), shard))
 
-    def __init__(self, name, description, products=None):
+    def __retire(self):
+        # Вызывается под self.lock; завершившийся поток в свой счётчик больше не пишет
+        live = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self.base += shard[0]
+        self.shards = live
+
+    def value(self):
+        with self.lock:
+            self.__retire()
+            shards = [shard for _, shard in self.shards]
+            base = self.base
+        return base + sum(shard[0] for shard in shards)
+
+    def set(self, value):
+        with self.lock:
+            for _, shard in self.shards:
+                shard[0] = 0
+            self.base = value
+
+
+class CategoryMeta(type):
+    # Category.category_count и Category.product_count читаются и присваиваются как обычные атрибуты класса
+    @property
+    def category_count(cls):
+        return cls._category_counter.value()
+
+    @category_count.setter
+    def category_count(cls, value):
+        cls._category_counter.set(value)
+
+    @property
+    def product_count(cls):
+        return cls._product_counter.value()
+
+    @product_count.setter
+    def product_count(cls, value):
+        cls._product_counter.set(value)
+
+
+class Category(metaclass=CategoryMeta):
+    # Изменения одной категории из разных потоков идут под её _lock (RLock: сеттер цены товара
+    # внутри add_product доставляет дельты в _field_changed той же категории). Отложенные
+    # дельты batch() сливаются до захвата блокировки, чтобы не держать две категории сразу
+    _category_counter = ShardedCounter()
+    _product_counter = ShardedCounter()
+
+    def __init__(self, name, description, products=None, columnar=False):
+        # Товары ссылаются на категорию только через _ref (см. BaseProduct._owners)
+        self._ref = weakref.ref(self)
+        self._lock = threading.RLock()
         self.name = name
         self.description = description
-        self.__products = products if products else []
-        Category.category_count += 1
-        Category.product_count += len(self.__products)
+        self.columnar = columnar
+        self._catalogs = ()
+        # Поисковые индексы (Les_16_search.ProductSearch), которым передаются изменения полей товаров
+        self._searches = ()
+        if products:
+            product_events.flush()
+        self.__products = self.__storage(list(products) if products else [])
+        Category._category_counter.add(1)
+        Category._product_counter.add(len(self.__products))
+
+    @property
+    def category_count(self):
+        return Category.category_count
+
+    @property
+    def product_count(self):
+        return Category.product_count
+
+    @classmethod
+    def _restore(cls, name, description, storage, totals):
+        # Категория поверх готового колоночного хранилища с уже посчитанными итогами
+        category = cls(name, description, columnar=True)
+        category.__products = storage
+        category._generation += 1
+        (category._quantity_total, category._price_total, category._value_total,
+         category._float_prices, category._type_totals) = totals
+        Category._product_counter.add(len(storage))
+        return category
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Категория из load_snapshot держит отображённый в память файл снимка; он закрывается
+        # здесь, а не при сборке мусора. Обычной категории закрывать нечего
+        with self._lock:
+            close = getattr(self.__products, "close", None)
+        if close is not None:
+            close()
+
+    def _totals(self):
+        return (self._quantity_total, self._price_total, self._value_total,
+                self._float_prices, {cls: tuple(totals) for cls, totals in self._type_totals.items()})
+
+    def iter_records(self):
+        if self.columnar:
+            for index in range(len(self.__products)):
+                yield self.__products.record_at(index)
+        else:
+            for product in self.__products:
+                yield type(product), tuple(getattr(product, field) for field in product.fields)
+
+    def __storage(self, products):
+        # Накопленные итоги - целые копейки, поэтому точно совпадают с полным пересчётом
+        self._quantity_total = 0
+        self._price_total = 0
+        self._value_total = 0
+        self._float_prices = 0
+        self._type_totals = {}
+        self._rendered = None
+        self._indexes = {}
+        self._version = getattr(self, "_version", 0)
+        self.__touch()
+        # Поколение меняется только при замене хранилища; позиции внутри поколения не сдвигаются
+        self._generation = getattr(self, "_generation", 0) + 1
+        for product in products:
+            self.__track(product)
+        return ProductColumns(products) if self.columnar else products
+
+    def __track(self, product):
+        # Горячий путь add_product: копейки, итог по классу и версия считаются здесь же,
+        # без вызовов to_kopecks/__type_total/__touch на каждый товар
+        price = product._price
+        quantity = product._quantity
+        float_price = type(price) is float
+        kopecks = round(price * 100) if float_price else price * 100
+        value = kopecks * quantity
+        self._quantity_total += quantity
+        self._price_total += kopecks
+        self._value_total += value
+        self._float_prices += float_price
+        totals = self.__class_totals(type(product))
+        totals[0] += value
+        totals[1] += float_price
+        self._rendered = None
+        self._version += 1
+        for catalog in self._catalogs:
+            catalog._dirty.add(self)
+        if not self.columnar:
+            with _back_refs_locks[(id(product) >> 4) % len(_back_refs_locks)]:
+                product._categories += (self._ref,)
+
+    def __untrack_all(self):
+        if not self.columnar:
+            for product in self.__products:
+                with back_refs_lock(product):
+                    product._categories = tuple(ref for ref in product._categories if ref is not self._ref)
+
+    def __value(self, product, position, field):
+        if self.columnar:
+            if field == "stock_value":
+                return self.__products.value_at(position, "price") * self.__products.value_at(position, "quantity")
+            return self.__products.value_at(position, field)
+        return getattr(product, field, MISSING)
+
+    def __index(self, product, position):
+        for (kind, field), index in self._indexes.items():
+            value = self.__value(product, position, field)
+            if value is not MISSING:
+                index.add(value, position)
+
+    def __index_items(self, field, start):
+        # Пары (значение поля, позиция) для товаров хранилища начиная с позиции start
+        for position in range(start, len(self.__products)):
+            product = None if self.columnar else self.__products[position]
+            value = self.__value(product, position, field)
+            if value is not MISSING:
+                yield value, position
+
+    def __get_index(self, kind, field):
+        # Вызывается под self._lock: индекс строится и публикуется целиком, пока add_product ждёт,
+        # иначе товар, добавленный во время построения, не попал бы ни в обход, ни в индекс
+        index = self._indexes.get((kind, field))
+        if index is None:
+            index = HashIndex() if kind == "hash" else SortedIndex()
+            index.extend(self.__index_items(field, 0))
+            self._indexes[(kind, field)] = index
+        return index
+
+    def __top(self, by, reverse, product_cls, limit):
+        with self._lock:
+            positions = self.__get_index("sorted", by).positions
+            products = []
+            for position in reversed(positions) if reverse else positions:
+                product = self.__products[position]
+                if product_cls is None or isinstance(product, product_cls):
+                    products.append(product)
+                    if len(products) == limit:
+                        break
+            return products
+
+    def find(self, field, value):
+        with self._lock:
+            return [self.__products[position] for position in self.__get_index("hash", field).find(value)]
+
+    def find_range(self, field, low=None, high=None):
+        with self._lock:
+            return [self.__products[position] for position in self.__get_index("sorted", field).range(low, high)]
+
+    def sorted_view(self, by="price", reverse=False, product_cls=None):
+        # Обход по поддерживаемому отсортированному индексу; by - price, quantity, stock_value или поле наследника.
+        # Позиции копируются под блокировкой: параллельный add_product вставляет в индекс на месте,
+        # а хранилище только дополняется, поэтому скопированные позиции в нём остаются верными
+        with self._lock:
+            positions = list(self.__get_index("sorted", by).positions)
+            storage = self.__products
+        for position in reversed(positions) if reverse else positions:
+            product = storage[position]
+            if product_cls is None or isinstance(product, product_cls):
+                yield product
+
+    def top(self, k, by="price", largest=True, product_cls=None):
+        # Если индекс по by уже поддерживается - ответ за O(k) с его края, иначе выбор кучей за O(n log k)
+        if ("sorted", by) in self._indexes:
+            return self.__top(by, largest, product_cls, k) if k > 0 else []
+        # Как и в индексе, товары без поля by (memory у Product) в выборку не попадают
+        products = (product for product in self.snapshot()
+                    if (product_cls is None or isinstance(product, product_cls)) and hasattr(product, by))
+        select = heapq.nlargest if largest else heapq.nsmallest
+        return select(k, products, key=attrgetter(by))
+
+    def __touch(self):
+        # Итоги категории изменились: новая версия, а каталоги пересчитают её вклад при чтении
+        self._version += 1
+        for catalog in self._catalogs:
+            catalog._dirty.add(self)
+
+    def _field_changed(self, product, field, old, new, quantity=None):
+        # Вызывается на каждую смену цены или остатка, поэтому дельты итогов считаются здесь же
+        with self._lock:
+            self._rendered = None
+            self._version += 1
+            for catalog in self._catalogs:
+                catalog._dirty.add(self)
+            if old == new:
+                return
+            if field == "price":
+                if quantity is None:
+                    quantity = product._quantity
+                old_float = type(old) is float
+                new_float = type(new) is float
+                delta = (round(new * 100) if new_float else new * 100) - (round(old * 100) if old_float else old * 100)
+                float_prices = new_float - old_float
+                self._price_total += delta
+                self._value_total += delta * quantity
+                self._float_prices += float_prices
+                # Товар уже учтён в категории, поэтому итог его класса существует
+                totals = self._type_totals[type(product)]
+                totals[0] += delta * quantity
+                totals[1] += float_prices
+            elif field == "quantity":
+                delta = to_kopecks(product._price) * (new - old)
+                self._quantity_total += new - old
+                self._value_total += delta
+                self._type_totals[type(product)][0] += delta
+            if self._indexes:
+                self.__move_keys(product, field, old, new, quantity)
+            for search in self._searches:
+                search.on_change(product, field, old, new)
+
+    def __move_keys(self, product, field, old, new, quantity):
+        moves = [(field, old, new)]
+        if field == "price":
+            moves.append(("stock_value", old * quantity, new * quantity))
+        elif field == "quantity":
+            moves.append(("stock_value", product.price * old, product.price * new))
+        for (kind, name), index in self._indexes.items():
+            for moved, old_key, new_key in moves:
+                if name == moved:
+                    for position in index.find(old_key):
+                        if self.__products[position] is product:
+                            index.remove(old_key, position)
+                            index.add(new_key, position)
+
+    def __class_totals(self, cls):
+        # Итоги по классам товаров: [стоимость в копейках, количество цен float]
+        try:
+            return self._type_totals[cls]
+        except KeyError:
+            totals = self._type_totals[cls] = [0, 0]
+            return totals
 
     def add_product(self, product):
         if isinstance(product, BaseProduct):
-            self.__products.append(product)
-            Category.product_count += 1
+            # Дельты, отложенные в batch(), уходят прежним владельцам до появления товара здесь;
+            # без отложенных изменений flush() не вызывается
+            if product_events.local.pending:
+                product_events.flush()
+            with self._lock:
+                self.__track(product)
+                self.__products.append(product)
+                if self._indexes:
+                    self.__index(product, len(self.__products) - 1)
+            Category._product_counter.add(1)
         else:
             raise TypeError("Можно добавить только объекты класса Product или его наследников (Smartphone/LawnGrass)")
 
+    def bulk_load(self, rows, product_cls, batch_size=10000, trusted=False, report=None):
+        if not (isinstance(product_cls, type) and issubclass(product_cls, BaseProduct)):
+            raise TypeError("Можно добавить только объекты класса Product или его наследников (Smartphone/LawnGrass)")
+        loaded = 0
+        seen = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                loaded += self.__load_batch(product_cls, batch, trusted, report, seen)
+                seen += len(batch)
+                batch = []
+        if batch:
+            loaded += self.__load_batch(product_cls, batch, trusted, report, seen)
+        return loaded
+
+    def __load_batch(self, product_cls, rows, trusted=False, report=None, start=0):
+        records = product_cls.records_from_rows(rows, trusted, report, start)
+        if not records:
+            return 0
+        with self._lock:
+            self.__append_records(product_cls, records)
+        Category._product_counter.add(len(records))
+        return len(records)
+
+    def __append_records(self, product_cls, records):
+        self.__touch()
+        prices = [record[2] for record in records]
+        quantities = [record[3] for record in records]
+        self._quantity_total += sum(quantities)
+        self._price_total += exact_total(prices)
+        value = exact_total(prices, quantities)
+        float_prices = sum(isinstance(price, float) for price in prices)
+        self._value_total += value
+        self._float_prices += float_prices
+        totals = self.__class_totals(product_cls)
+        totals[0] += value
+        totals[1] += float_prices
+        self._rendered = None
+        start = len(self.__products)
+        if self.columnar:
+            for record in records:
+                self.__products.append_record(product_cls, record)
+        else:
+            products = [product_cls.from_record(record) for record in records]
+            for product in products:
+                product._categories = (self._ref,)
+            logger = getattr(product_cls, "init_logger", None)
+            if logger is not None:
+                for record in records:
+                    logger(product_cls.__name__, record[:4])
+            self.__products.extend(products)
+        # Поддерживаемые индексы не сбрасываются: пачка сортируется и вливается в них целиком
+        for (kind, field), index in self._indexes.items():
+            index.extend(self.__index_items(field, start))
+
     @property
     def products(self):
-        products = [str(product) for product in self.__products]
-        return "\n".join(products) + "\n"
+        # Строка собирается вне блокировки, а в кеш попадает, только если за это время
+        # категория не менялась: иначе add_product уже сбросил кеш и старая строка его бы затёрла
+        rendered = self._rendered
+        if rendered is None:
+            snapshot = self.snapshot()
+            rendered = snapshot.products
+            with self._lock:
+                if self._version == snapshot.version:
+                    self._rendered = rendered
+        return rendered
+
+    def iter_products(self):
+        return self.snapshot().iter_products()
+
+    def snapshot(self):
+        with self._lock:
+            return CategorySnapshot(self, self.__products)
+
+    def page(self, number, size=50):
+        # Страницы нумеруются с 1; отрисовываются только товары запрошенной страницы
+        if number < 1 or size < 1:
+            raise ValueError("Номер и размер страницы должны быть положительными")
+        return self.snapshot().page((number - 1) * size, size)
+
+    def page_after(self, cursor=None, size=50):
+        # Курсор - позиция в хранилище, которое только дополняется, поэтому add_product его не сдвигает
+        if size < 1:
+            raise ValueError("Размер страницы должен быть положительным")
+        snapshot = self.snapshot()
+        start = 0
+        if cursor is not None:
+            generation, start = map(int, cursor.split(":"))
+            if generation != snapshot.generation:
+                raise ValueError("Курсор устарел: список товаров категории был заменён")
+        return snapshot.page(start, size)
+
+    def write_products(self, file, chunk_size=1000):
+        chunk = []
+        for line in self.iter_products():
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                file.write("".join(chunk))
+                chunk.clear()
+        if chunk:
+            file.write("".join(chunk))
 
     @products.setter
     def products(self, value):
         if isinstance(value, list):
             if all(isinstance(product, BaseProduct) for product in value):
-                self.__products = value
+                product_events.flush()
+                with self._lock:
+                    self.__untrack_all()
+                    self.__products = self.__storage(list(value))
             else:
                 raise TypeError(
                     "Можно добавить только объекты класса Product или его наследников (Smartphone/LawnGrass)")
         elif isinstance(value, BaseProduct):
-            self.__products.append(value)
+            product_events.flush()
+            with self._lock:
+                self.__track(value)
+                self.__products.append(value)
+                self.__index(value, len(self.__products) - 1)
         else:
             raise TypeError("Можно добавить только объекты класса Product или его наследников (Smartphone/LawnGrass)")
 
     def __str__(self):
-        total_products_count = sum([p.quantity for p in self.__products])
+        total_products_count = self._total_quantity()
         return f"{self.name}, количество продуктов: {total_products_count} шт."
 
     def __add__(self, other):
         if isinstance(other, Category):
-            total_cost = sum(product.price * product.quantity for product in self.__products)
-            total_cost += sum(product.price * product.quantity for product in other.__products)
-            return total_cost
+            return total_value((self, other))
         raise TypeError("Ошибка сложения. Нельзя складывать не экземпляры одного класса")
 
     def get_result(self):
@@ -153,140 +1200,337 @@ class Category:
 
     def middle_price(self):
         unique_products_count = len(self.__products)
-        total_price = sum(product.price for product in self.__products)
         if unique_products_count == 0:
             return 0
-        return total_price / unique_products_count
-
-
-# Пример использования
-data_smartphones = [
-    {
-        "name": "Samsung Galaxy C23 Ultra",
-        "description": "256GB, Серый цвет, 200MP камера",
-        "price": 180000.0,
-        "quantity": 5,
-        "efficiency": "Высокая",
-        "model": "C23 Ultra",
-        "memory": 256,
-        "color": "Серый"
-    },
-    {
-        "name": "Iphone 15",
-        "description": "512GB, Gray space",
-        "price": 210000.0,
-        "quantity": 8,
-        "efficiency": "Высокая",
-        "model": "15",
-        "memory": 512,
-        "color": "Серый"
-    },
-    {
-        "name": "Xiaomi Redmi Note 11",
-        "description": "1024GB, Синий",
-        "price": 31000.0,
-        "quantity": 14,
-        "efficiency": "Высокая",
-        "model": "Note 11",
-        "memory": 1024,
-        "color": "Синий"
-    }
-]
-
-data_products = [
-    {
-        "name": "55 QLED 4K",
-        "description": "Фоновая подсветка",
-        "price": 123000.0,
-        "quantity": 7
-    }
-]
-
-category_smartphones = Category("Смартфоны",
-                                "Смартфоны, как средство не только коммуникации, но и получения дополнительных функций для удобства жизни")
-category_products = Category("Продукты", "Различные продукты для теста")
-
-for product_data in data_smartphones:
-    smartphone = Smartphone.new_product(product_data)
-    category_smartphones.add_product(smartphone)
-
-for product_data in data_products:
-    product = Product.new_product(product_data)
-    category_products.add_product(product)
-
-# Примеры использования новых функций
-try:
-    test_product = Product("Test", "Test", 1000, 10)
-    print(test_product)
-except ValueError as e:
-    print(e)
-
-category_test = Category("Тестовая категория", "Категория для тестирования")
-
-test_product_2 = Smartphone("Test2", "Test2", 2000, 10, "Высокая", "Модель", 256, "Черный")
-category_test.add_product(test_product_2)
-
-test_product_3 = LawnGrass("Test3", "Test3", 3000, 10, "Россия", 7, "Зеленый")
-category_test.add_product(test_product_3)
-
-# Проверка среднего ценника
-expected_middle_price = 140333.33333333334
-actual_middle_price = category_smartphones.middle_price()
-
-# Вывод всех продуктов для проверки
-print("Вывод всех продуктов в категории 'Смартфоны':")
-print(category_smartphones.get_result())
-print("Вывод всех продуктов в категории 'Продукты':")
-print(category_products.get_result())
-print("Вывод всех продуктов в категории 'Тестовая категория':")
-print(category_test.get_result())
-
-# Вывод отладочной информации
-print(f"Ожидаемый средний ценник: {expected_middle_price}")
-print(f"Фактический средний ценник: {actual_middle_price}")
-
-# Вычисление общей стоимости и количества для проверки
-total_price = sum(product.price for product in category_smartphones._Category__products)
-unique_products_count = len(category_smartphones._Category__products)
-print(f"Общая стоимость: {total_price}")
-print(f"Количество уникальных товаров: {unique_products_count}")
-calculated_middle_price = total_price / unique_products_count
-print(f"Вычисленный средний ценник: {calculated_middle_price}")
-
-# Проверка среднего ценника с учетом точности
-price_comparison_result = abs(actual_middle_price - expected_middle_price) < 1e-6
-print(f"Средний ценник совпадает: {price_comparison_result}")
-
-# Убедимся, что сравнение происходит корректно
-print(f"Средний ценник совпадает с точностью до 1e-6: {abs(actual_middle_price - expected_middle_price) < 1e-6}")
-
-# Проверка всех продуктов для соответствия ожидаемому выводу
-expected_output = [
-    "Smartphone('Samsung Galaxy C23 Ultra', '256GB, Серый цвет, 200MP камера', 180000.0, 5, 'Высокая', 'C23 Ultra', 256, 'Серый')",
-    "Smartphone('Iphone 15', '512GB, Gray space', 210000.0, 8, 'Высокая', '15', 512, 'Серый')",
-    "Smartphone('Xiaomi Redmi Note 11', '1024GB, Синий', 31000.0, 14, 'Высокая', 'Note 11', 1024, 'Синий')",
-    "Product('55 QLED 4K', 'Фоновая подсветка', 123000.0, 7)",
-    "Product('Test', 'Test', 1000, 10)",
-    "Smartphone('Test2', 'Test2', 2000, 10, 'Высокая', 'Модель', 256, 'Черный')",
-    "LawnGrass('Test3', 'Test3', 3000, 10, 'Россия', 7, 'Зеленый')"
-]
-
-actual_output = [
-                    repr(product) for product in category_smartphones._Category__products
-                ] + [
-                    repr(product) for product in category_products._Category__products
-                ] + [
-                    repr(product) for product in category_test._Category__products
-                ]
-
-print("Ожидаемый вывод продуктов:")
-print("\n".join(expected_output))
-print("Фактический вывод продуктов:")
-print("\n".join(actual_output))
-
-products_match = expected_output == actual_output
-print(f"Вывод продуктов совпадает: {products_match}")
-
-# Финальная проверка
-final_check = products_match and price_comparison_result
-print(f"Финальная проверка: {final_check}")
+        return self._price_total / (100 * unique_products_count)
+
+    def _total_quantity(self):
+        return self._quantity_total
+
+
+class CategorySnapshot:
+    # Срез категории на момент вызова Category.snapshot(). Хранилище товаров только дополняется,
+    # а сеттер products подменяет его новым, поэтому срезу достаточно ссылки и длины
+    def __init__(self, category, storage):
+        self.name = category.name
+        self.description = category.description
+        self.version = category._version
+        self.generation = category._generation
+        self.storage = storage
+        self.count = len(storage)
+        self.totals = category._totals()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.storage[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("Индекс товара вне диапазона")
+        return self.storage[index]
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.storage[index]
+
+    def iter_products(self):
+        if not self.count:
+            yield "\n"
+        for product in self:
+            yield product.rendered() + "\n"
+
+    @property
+    def products(self):
+        return "".join(self.iter_products())
+
+    def page(self, start, size):
+        products = self[start:start + size]
+        end = min(start + size, self.count)
+        return Page(products, "".join([product.rendered() + "\n" for product in products]),
+                    f"{self.generation}:{max(start, end)}", end < self.count)
+
+    def __str__(self):
+        return f"{self.name}, количество продуктов: {self.totals[0]} шт."
+
+    def middle_price(self):
+        if self.count == 0:
+            return 0
+        return self.totals[1] / (100 * self.count)
+
+    def total_value(self):
+        return as_number(self.totals[2], self.totals[3])
+
+
+class Catalog:
+    # Набор категорий с общими итогами. Вклад каждой категории запоминается; изменённые
+    # категории сами отмечаются в _dirty, и при чтении пересчитывается только их вклад
+    def __init__(self, name, categories=()):
+        self.name = name
+        self.__categories = {}
+        self._dirty = set()
+        self.__count = 0
+        self.__quantity_total = 0
+        self.__price_total = 0
+        self.__value_total = 0
+        self.__float_prices = 0
+        self.__type_totals = {}
+        for category in categories:
+            self.add_category(category)
+
+    def add_category(self, category):
+        if not isinstance(category, Category):
+            raise TypeError("В каталог можно добавить только объекты класса Category")
+        if category in self.__categories:
+            return
+        category._catalogs += (self,)
+        part = category.snapshot()
+        self.__categories[category] = part
+        self.__apply(part, 1)
+
+    def remove_category(self, category):
+        self.__refresh()
+        part = self.__categories.pop(category)
+        category._catalogs = tuple(catalog for catalog in category._catalogs if catalog is not self)
+        self.__apply(part, -1)
+
+    def __apply(self, part, sign):
+        quantity_total, price_total, value_total, float_prices, type_totals = part.totals
+        self.__count += sign * part.count
+        self.__quantity_total += sign * quantity_total
+        self.__price_total += sign * price_total
+        self.__value_total += sign * value_total
+        self.__float_prices += sign * float_prices
+        for cls, (value, float_seen) in type_totals.items():
+            totals = self.__type_totals.setdefault(cls, [0, 0])
+            totals[0] += sign * value
+            totals[1] += sign * float_seen
+            if not totals[0] and not totals[1]:
+                del self.__type_totals[cls]
+
+    def __refresh(self):
+        while self._dirty:
+            category = self._dirty.pop()
+            if category in self.__categories:
+                self.__apply(self.__categories[category], -1)
+                self.__categories[category] = part = category.snapshot()
+                self.__apply(part, 1)
+
+    def __len__(self):
+        return len(self.__categories)
+
+    def __iter__(self):
+        return iter(list(self.__categories))
+
+    def __contains__(self, category):
+        return category in self.__categories
+
+    def __str__(self):
+        return f"{self.name}, категорий: {len(self)}, количество продуктов: {self.total_quantity()} шт."
+
+    def product_count(self):
+        self.__refresh()
+        return self.__count
+
+    def total_quantity(self):
+        self.__refresh()
+        return self.__quantity_total
+
+    def total_price(self):
+        self.__refresh()
+        return as_number(self.__price_total, self.__float_prices)
+
+    def total_value(self, unique=False):
+        if unique:
+            return total_value(self, unique=True)
+        self.__refresh()
+        return as_number(self.__value_total, self.__float_prices)
+
+    def value_by_type(self):
+        self.__refresh()
+        return {cls.__name__: as_number(value, float_prices)
+                for cls, (value, float_prices) in self.__type_totals.items()}
+
+    def middle_price(self):
+        self.__refresh()
+        if self.__count == 0:
+            return 0
+        return self.__price_total / (100 * self.__count)
+
+
+def stock_value(products):
+    prices = [product.price for product in products]
+    quantities = [product.quantity for product in products]
+    return as_number(exact_total(prices, quantities), any(isinstance(price, float) for price in prices))
+
+
+def total_value(categories, unique=False):
+    # unique - товар с одним SKU в нескольких категориях учитывается один раз; это полный проход
+    if unique:
+        records = {}
+        for category in categories:
+            for cls, record in category.iter_records():
+                records.setdefault(sku(cls, record), record)
+        prices = [record[2] for record in records.values()]
+        quantities = [record[3] for record in records.values()]
+        return as_number(exact_total(prices, quantities), any(isinstance(price, float) for price in prices))
+    total = sum(category._value_total for category in categories)
+    return as_number(total, any(category._float_prices for category in categories))
+
+
+def value_by_type(categories):
+    totals = {}
+    for category in categories:
+        for cls, (value, float_prices) in category._type_totals.items():
+            total, float_seen = totals.get(cls.__name__, (0, 0))
+            totals[cls.__name__] = (total + value, float_seen + float_prices)
+    return {name: as_number(total, float_prices) for name, (total, float_prices) in totals.items()}
+
+
+def value_with_overrides(categories, price_overrides):
+    # price_overrides: {название товара: цена}; пересчитываются только затронутые товары через индекс по name
+    total = 0
+    has_float = any(isinstance(price, float) for price in price_overrides.values())
+    for category in categories:
+        total += category._value_total
+        has_float = has_float or category._float_prices
+        for name, price in price_overrides.items():
+            for product in category.find("name", name):
+                total += (to_kopecks(price) - to_kopecks(product.price)) * product.quantity
+    return as_number(total, has_float)
+
+
+if __name__ == "__main__":
+    # Пример использования
+    data_smartphones = [
+        {
+            "name": "Samsung Galaxy C23 Ultra",
+            "description": "256GB, Серый цвет, 200MP камера",
+            "price": 180000.0,
+            "quantity": 5,
+            "efficiency": "Высокая",
+            "model": "C23 Ultra",
+            "memory": 256,
+            "color": "Серый"
+        },
+        {
+            "name": "Iphone 15",
+            "description": "512GB, Gray space",
+            "price": 210000.0,
+            "quantity": 8,
+            "efficiency": "Высокая",
+            "model": "15",
+            "memory": 512,
+            "color": "Серый"
+        },
+        {
+            "name": "Xiaomi Redmi Note 11",
+            "description": "1024GB, Синий",
+            "price": 31000.0,
+            "quantity": 14,
+            "efficiency": "Высокая",
+            "model": "Note 11",
+            "memory": 1024,
+            "color": "Синий"
+        }
+    ]
+
+    data_products = [
+        {
+            "name": "55 QLED 4K",
+            "description": "Фоновая подсветка",
+            "price": 123000.0,
+            "quantity": 7
+        }
+    ]
+
+    category_smartphones = Category("Смартфоны",
+                                    "Смартфоны, как средство не только коммуникации, но и получения дополнительных функций для удобства жизни")
+    category_products = Category("Продукты", "Различные продукты для теста")
+
+    for product_data in data_smartphones:
+        smartphone = Smartphone.new_product(product_data)
+        category_smartphones.add_product(smartphone)
+
+    for product_data in data_products:
+        product = Product.new_product(product_data)
+        category_products.add_product(product)
+
+    # Примеры использования новых функций
+    try:
+        test_product = Product("Test", "Test", 1000, 10)
+        print(test_product)
+    except ValueError as e:
+        print(e)
+
+    category_test = Category("Тестовая категория", "Категория для тестирования")
+
+    test_product_2 = Smartphone("Test2", "Test2", 2000, 10, "Высокая", "Модель", 256, "Черный")
+    category_test.add_product(test_product_2)
+
+    test_product_3 = LawnGrass("Test3", "Test3", 3000, 10, "Россия", 7, "Зеленый")
+    category_test.add_product(test_product_3)
+
+    # Проверка среднего ценника
+    expected_middle_price = 140333.33333333334
+    actual_middle_price = category_smartphones.middle_price()
+
+    # Вывод всех продуктов для проверки
+    print("Вывод всех продуктов в категории 'Смартфоны':")
+    print(category_smartphones.get_result())
+    print("Вывод всех продуктов в категории 'Продукты':")
+    print(category_products.get_result())
+    print("Вывод всех продуктов в категории 'Тестовая категория':")
+    print(category_test.get_result())
+
+    # Вывод отладочной информации
+    print(f"Ожидаемый средний ценник: {expected_middle_price}")
+    print(f"Фактический средний ценник: {actual_middle_price}")
+
+    # Вычисление общей стоимости и количества для проверки
+    total_price = sum(product.price for product in category_smartphones._Category__products)
+    unique_products_count = len(category_smartphones._Category__products)
+    print(f"Общая стоимость: {total_price}")
+    print(f"Количество уникальных товаров: {unique_products_count}")
+    calculated_middle_price = total_price / unique_products_count
+    print(f"Вычисленный средний ценник: {calculated_middle_price}")
+
+    # Проверка среднего ценника с учетом точности
+    price_comparison_result = abs(actual_middle_price - expected_middle_price) < 1e-6
+    print(f"Средний ценник совпадает: {price_comparison_result}")
+
+    # Убедимся, что сравнение происходит корректно
+    print(f"Средний ценник совпадает с точностью до 1e-6: {abs(actual_middle_price - expected_middle_price) < 1e-6}")
+
+    # Проверка всех продуктов для соответствия ожидаемому выводу
+    expected_output = [
+        "Smartphone('Samsung Galaxy C23 Ultra', '256GB, Серый цвет, 200MP камера', 180000.0, 5, 'Высокая', 'C23 Ultra', 256, 'Серый')",
+        "Smartphone('Iphone 15', '512GB, Gray space', 210000.0, 8, 'Высокая', '15', 512, 'Серый')",
+        "Smartphone('Xiaomi Redmi Note 11', '1024GB, Синий', 31000.0, 14, 'Высокая', 'Note 11', 1024, 'Синий')",
+        "Product('55 QLED 4K', 'Фоновая подсветка', 123000.0, 7)",
+        "Product('Test', 'Test', 1000, 10)",
+        "Smartphone('Test2', 'Test2', 2000, 10, 'Высокая', 'Модель', 256, 'Черный')",
+        "LawnGrass('Test3', 'Test3', 3000, 10, 'Россия', 7, 'Зеленый')"
+    ]
+
+    actual_output = [
+                        repr(product) for product in category_smartphones._Category__products
+                    ] + [
+                        repr(product) for product in category_products._Category__products
+                    ] + [
+                        repr(product) for product in category_test._Category__products
+                    ]
+
+    print("Ожидаемый вывод продуктов:")
+    print("\n".join(expected_output))
+    print("Фактический вывод продуктов:")
+    print("\n".join(actual_output))
+
+    products_match = expected_output == actual_output
+    print(f"Вывод продуктов совпадает: {products_match}")
+
+    # Финальная проверка
+    final_check = products_match and price_comparison_result
+    print(f"Финальная проверка: {final_check}")
@@ -0,0 +1,302 @@
+import csv
+import json
+import struct
+import time
+from array import array
+from collections import namedtuple
+
+from Les_16_hmw import LawnGrass, Product, Smartphone
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PRODUCT_CLASSES = {cls.__name__: cls for cls in (Product, Smartphone, LawnGrass)}
+TYPE_FIELD = "type"
+IngestStats = namedtuple("IngestStats", "rows loaded seconds rows_per_second peak_rss")
+
+
+def product_class(name, classes, default):
+    if not name:
+        if default is None:
+            raise TypeError("У строки не указан тип товара")
+        return default
+    try:
+        return classes[name]
+    except KeyError:
+        raise TypeError(f"Неизвестный тип товара: {name}") from None
+
+
+def read_jsonl(file, type_field=TYPE_FIELD, classes=None, default=Product):
+    # Строки читаются по одной; на выходе пары (класс товара, словарь полей без поля типа)
+    classes = classes or PRODUCT_CLASSES
+    for line in file:
+        if line.strip():
+            row = json.loads(line)
+            yield product_class(row.pop(type_field, None), classes, default), row
+
+
+def parse_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def converters(cls):
+    # В CSV всё строки: числа приводятся по типам из field_rules, непереводимые значения
+    # остаются строками и отсекаются проверкой при загрузке
+    result = {}
+    for field, (types, _) in cls.field_rules.items():
+        if str not in types:
+            result[field] = parse_number if float in types else int
+    return result
+
+
+def read_csv(file, type_field=TYPE_FIELD, classes=None, default=Product):
+    # Общая шапка на все классы; пустые ячейки означают, что у класса такого поля нет
+    classes = classes or PRODUCT_CLASSES
+    parsers = {}
+    for row in csv.DictReader(file):
+        cls = product_class(row.pop(type_field, None), classes, default)
+        if cls not in parsers:
+            parsers[cls] = converters(cls)
+        parse = parsers[cls]
+        record = {}
+        for field, value in row.items():
+            if value:
+                if field in parse:
+                    try:
+                        value = parse[field](value)
+                    except ValueError:
+                        pass
+                record[field] = value
+        yield cls, record
+
+
+def read_file(path, type_field=TYPE_FIELD, classes=None, default=Product):
+    if path.endswith(".l16c"):
+        yield from read_columnar(path, classes)
+        return
+    reader = read_csv if path.endswith(".csv") else read_jsonl
+    with open(path, encoding="utf-8", newline="") as file:
+        yield from reader(file, type_field, classes, default)
+
+
+def iter_products(typed_rows):
+    for cls, row in typed_rows:
+        yield cls.new_product(row)
+
+
+def peak_rss():
+    # Пиковый размер процесса в КБ (ru_maxrss на Linux); None, если модуля resource нет
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def ingest(category, typed_rows, batch_size=10000, trusted=False, report=None):
+    # В памяти держится не больше одной пачки строк. Пачка отправляется в bulk_load, когда
+    # заполнена или сменился класс товара, поэтому порядок товаров в категории как в файле
+    rows = loaded = 0
+    batch = []
+    batch_cls = None
+    start = time.perf_counter()
+
+    def flush():
+        errors = None if report is None else []
+        count = category.bulk_load(batch, batch_cls, batch_size, trusted, errors)
+        if errors:
+            offset = rows - len(batch)
+            report.extend(error._replace(row=error.row + offset) for error in errors)
+        batch.clear()
+        return count
+
+    for cls, row in typed_rows:
+        if batch and (cls is not batch_cls or len(batch) >= batch_size):
+            loaded += flush()
+        batch_cls = cls
+        batch.append(row)
+        rows += 1
+    if batch:
+        loaded += flush()
+    seconds = time.perf_counter() - start
+    return IngestStats(rows, loaded, seconds, rows / seconds if seconds else 0.0, peak_rss())
+
+
+def ingest_file(category, path, batch_size=10000, trusted=False, report=None, type_field=TYPE_FIELD):
+    stats = ingest(category, read_file(path, type_field), batch_size, trusted, report)
+    print(f"{path}: {stats.loaded} из {stats.rows} строк, {stats.rows_per_second:,.0f} строк/с, "
+          f"пик RSS {stats.peak_rss} КБ")
+    return stats
+
+
+# Экспорт. Записи берутся из Category.iter_records(), поэтому колоночная категория
+# выгружается без создания объектов товаров, а вывод пишется кусками по chunk_size строк
+BUFFER_SIZE = 1 << 20
+COLUMNAR_MAGIC = b"L16C"
+FOOTER = struct.Struct("<Q4s")
+
+
+def export_columns(classes=None):
+    # Общий набор колонок для всех классов: сначала поля BaseProduct, затем доп. поля наследников
+    columns = []
+    for cls in (classes or PRODUCT_CLASSES).values():
+        for field in cls.fields:
+            if field not in columns:
+                columns.append(field)
+    return columns
+
+
+def write_jsonl(category, path, chunk_size=10000, type_field=TYPE_FIELD):
+    count = 0
+    with open(path, "w", encoding="utf-8", buffering=BUFFER_SIZE) as file:
+        chunk = []
+        for cls, record in category.iter_records():
+            row = {type_field: cls.__name__}
+            row.update(zip(cls.fields, record))
+            chunk.append(json.dumps(row, ensure_ascii=False))
+            if len(chunk) >= chunk_size:
+                file.write("\n".join(chunk) + "\n")
+                count += len(chunk)
+                chunk.clear()
+        if chunk:
+            file.write("\n".join(chunk) + "\n")
+            count += len(chunk)
+    return count
+
+
+def write_csv(category, path, chunk_size=10000, type_field=TYPE_FIELD, classes=None):
+    columns = export_columns(classes)
+    layouts = {}
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="", buffering=BUFFER_SIZE) as file:
+        writer = csv.writer(file)
+        writer.writerow([type_field] + columns)
+        chunk = []
+        for cls, record in category.iter_records():
+            if cls not in layouts:
+                layouts[cls] = [cls.fields.index(column) if column in cls.fields else None for column in columns]
+            chunk.append([cls.__name__] + ["" if i is None else record[i] for i in layouts[cls]])
+            if len(chunk) >= chunk_size:
+                writer.writerows(chunk)
+                count += len(chunk)
+                chunk.clear()
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
+
+
+def column_kind(classes, field):
+    for cls in classes.values():
+        if field in cls.field_rules:
+            types = cls.field_rules[field][0]
+            if str in types:
+                return "str"
+            return "number" if float in types else "int"
+    return "str"
+
+
+def encode_column(kind, values):
+    # Маска заполненности, затем данные: строки - смещения и UTF-8, числа - массивы фиксированной ширины
+    valid = array('B', [value is not None for value in values])
+    if kind == "str":
+        encoded = [b"" if value is None else value.encode("utf-8") for value in values]
+        offsets = array('Q', [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        return valid.tobytes() + offsets.tobytes() + b"".join(encoded)
+    if kind == "int":
+        return valid.tobytes() + array('q', [value or 0 for value in values]).tobytes()
+    int_flags = array('B', [type(value) is int for value in values])
+    return valid.tobytes() + int_flags.tobytes() + array('d', [value or 0 for value in values]).tobytes()
+
+
+def decode_column(kind, data, rows):
+    valid = data[:rows]
+    if kind == "str":
+        offsets = array('Q')
+        offsets.frombytes(data[rows:rows + (rows + 1) * 8])
+        blob = data[rows + (rows + 1) * 8:]
+        values = [str(blob[offsets[i]:offsets[i + 1]], "utf-8") for i in range(rows)]
+    elif kind == "int":
+        values = array('q')
+        values.frombytes(data[rows:])
+    else:
+        int_flags = data[rows:2 * rows]
+        numbers = array('d')
+        numbers.frombytes(data[2 * rows:])
+        values = [int(number) if flag else number for number, flag in zip(numbers, int_flags)]
+    return [value if present else None for value, present in zip(values, valid)]
+
+
+def write_columnar(category, path, row_group_size=100000, classes=None):
+    # Файл из групп строк; в каждой группе колонки лежат подряд. В конце JSON-оглавление
+    # с расположением колонок, его длина и сигнатура - как у Parquet
+    classes = classes or PRODUCT_CLASSES
+    columns = export_columns(classes)
+    kinds = [column_kind(classes, column) for column in columns]
+    class_names = list(classes)
+    footer = {"classes": class_names, "columns": columns, "kinds": kinds, "row_groups": []}
+    count = 0
+    with open(path, "wb", buffering=BUFFER_SIZE) as file:
+        file.write(COLUMNAR_MAGIC)
+        offset = len(COLUMNAR_MAGIC)
+
+        def write_group(codes, values):
+            nonlocal offset
+            group = {"rows": len(codes), "chunks": []}
+            for data in [codes.tobytes()] + [encode_column(kind, column) for kind, column in zip(kinds, values)]:
+                file.write(data)
+                group["chunks"].append([offset, len(data)])
+                offset += len(data)
+            footer["row_groups"].append(group)
+
+        layouts = {}
+        codes = array('B')
+        values = [[] for _ in columns]
+        for cls, record in category.iter_records():
+            if cls not in layouts:
+                layouts[cls] = (class_names.index(cls.__name__),
+                                [cls.fields.index(column) if column in cls.fields else None for column in columns])
+            code, layout = layouts[cls]
+            codes.append(code)
+            for column, i in zip(values, layout):
+                column.append(None if i is None else record[i])
+            if len(codes) >= row_group_size:
+                write_group(codes, values)
+                count += len(codes)
+                codes = array('B')
+                values = [[] for _ in columns]
+        if codes:
+            write_group(codes, values)
+            count += len(codes)
+        meta = json.dumps(footer, ensure_ascii=False).encode("utf-8")
+        file.write(meta)
+        file.write(FOOTER.pack(len(meta), COLUMNAR_MAGIC))
+    return count
+
+
+def read_columnar(path, classes=None):
+    # Читает по одной группе строк; пары (класс, словарь полей) подходят для ingest()
+    classes = classes or PRODUCT_CLASSES
+    with open(path, "rb") as file:
+        file.seek(-FOOTER.size, 2)
+        meta_size, magic = FOOTER.unpack(file.read(FOOTER.size))
+        if magic != COLUMNAR_MAGIC:
+            raise ValueError(f"Файл {path} не является колоночной выгрузкой")
+        file.seek(-FOOTER.size - meta_size, 2)
+        footer = json.loads(file.read(meta_size).decode("utf-8"))
+        row_classes = [classes[name] for name in footer["classes"]]
+        for group in footer["row_groups"]:
+            rows = group["rows"]
+            chunks = []
+            for offset, size in group["chunks"]:
+                file.seek(offset)
+                chunks.append(file.read(size))
+            values = [decode_column(kind, data, rows) for kind, data in zip(footer["kinds"], chunks[1:])]
+            for i, code in enumerate(chunks[0]):
+                cls = row_classes[code]
+                yield cls, {field: column[i] for field, column in zip(footer["columns"], values)
+                            if column[i] is not None}
@@ -0,0 +1,39 @@
+from Les_16_hmw import as_number
+
+
+class Aggregate:
+    # Частичные суммы по набору товаров в целых копейках; складываются без потери точности
+    def __init__(self, count=0, quantity=0, price_total=0, value_total=0, float_prices=False):
+        self.count = count
+        self.quantity = quantity
+        self.price_total = price_total
+        self.value_total = value_total
+        self.float_prices = float_prices
+
+    def __add__(self, other):
+        return Aggregate(self.count + other.count, self.quantity + other.quantity,
+                         self.price_total + other.price_total, self.value_total + other.value_total,
+                         self.float_prices or other.float_prices)
+
+    def middle_price(self):
+        if self.count == 0:
+            return 0
+        return self.price_total / (100 * self.count)
+
+    def value(self):
+        return as_number(self.value_total, self.float_prices)
+
+
+def totals_aggregate(category):
+    # Итоги, которые категория поддерживает сама, без обхода товаров
+    snapshot = category.snapshot()
+    quantity, price_total, value_total, float_prices, _ = snapshot.totals
+    return Aggregate(snapshot.count, quantity, price_total, value_total, float_prices > 0)
+
+
+def aggregate_categories(categories):
+    # Каждая категория, в том числе колоночная, уже держит точные итоги в копейках, поэтому
+    # сводка по любому числу категорий - O(1) на категорию. Пул процессов здесь только
+    # сериализовал бы массивы и пересчитывал то же самое
+    per_category = [totals_aggregate(category) for category in categories]
+    return per_category, sum(per_category, Aggregate())
@@ -0,0 +1,249 @@
+import re
+import threading
+from functools import lru_cache
+from bisect import bisect_left
+from collections import Counter
+
+from Les_16_hmw import MISSING, ProductColumns
+
+TOKEN = re.compile(r"\w+")
+MERGE_THRESHOLD = 1000
+
+
+def normalize(text):
+    return text.lower().replace("ё", "е")
+
+
+@lru_cache(maxsize=1 << 16)
+def tokenize(text):
+    # \w в Python понимает кириллицу; "256GB, Серый" -> ("256gb", "серый").
+    # Описания и цвета у товаров часто совпадают, поэтому разбор кэшируется
+    return tuple(TOKEN.findall(normalize(text)))
+
+
+def trigrams(token):
+    padded = f"#{token}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductSearch:
+    # Инвертированный индекс по строковым полям товаров нескольких категорий.
+    # Хранилище категории только дополняется, поэтому перед запросом индекс догоняет его
+    # с последней проиндексированной позиции; замена списка товаров (новое поколение)
+    # приводит к переиндексации категории. Изменения полей товаров присылают сами категории,
+    # пока индекс к ним подключён: close() (или выход из with) отключает его от всех категорий.
+    # Изменения приходят из потоков-писателей под блокировкой категории, поэтому структуры индекса
+    # меняются и читаются только под self.lock, а снимки категорий берутся до его захвата
+    def __init__(self, categories=(), fields=None):
+        self.lock = threading.RLock()
+        self.fields = fields
+        self.categories = {}
+        self.docs = []
+        self.product_docs = {}
+        self.postings = {}
+        self.vocabulary = []
+        self.recent = []
+        self.trigram_tokens = {}
+        self.search_fields = {}
+        for category in categories:
+            self.add_category(category)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            for category in self.categories:
+                self.detach(category)
+            self.categories = {}
+
+    def add_category(self, category):
+        with self.lock:
+            if category in self.categories:
+                return
+            category._searches += (self,)
+            self.categories[category] = [None, None, 0]
+
+    def remove_category(self, category):
+        with self.lock:
+            self.detach(category)
+            if self.categories.pop(category)[0] is not None:
+                self.drop_category(category)
+
+    def detach(self, category):
+        category._searches = tuple(search for search in category._searches if search is not self)
+
+    def fields_of(self, cls):
+        fields = self.search_fields.get(cls)
+        if fields is None:
+            fields = self.search_fields[cls] = tuple(
+                field for field in cls.fields
+                if str in cls.field_rules[field][0] and (self.fields is None or field in self.fields))
+        return fields
+
+    def doc_tokens(self, cls, values):
+        tokens = set()
+        for field in self.fields_of(cls):
+            value = values.get(field, MISSING)
+            if isinstance(value, str):
+                tokens.update(tokenize(value))
+        return tokens
+
+    def add_token(self, token, doc):
+        docs = self.postings.get(token)
+        if docs is None:
+            docs = self.postings[token] = set()
+            # Новые слова копятся в коротком списке и вливаются в отсортированный словарь пачкой
+            self.recent.append(token)
+            if len(self.recent) > MERGE_THRESHOLD:
+                self.vocabulary = sorted(self.vocabulary + self.recent)
+                self.recent = []
+            for trigram in trigrams(token):
+                self.trigram_tokens.setdefault(trigram, set()).add(token)
+        docs.add(doc)
+
+    def remove_token(self, token, doc):
+        docs = self.postings.get(token)
+        if docs is not None:
+            docs.discard(doc)
+
+    def index_position(self, category, storage, position):
+        doc = len(self.docs)
+        self.docs.append((category, storage, position))
+        if isinstance(storage, ProductColumns):
+            cls, record = storage.record_at(position)
+            values = dict(zip(cls.fields, record))
+        else:
+            product = storage[position]
+            cls = type(product)
+            values = {field: getattr(product, field) for field in self.fields_of(cls)}
+            self.product_docs.setdefault(id(product), []).append(doc)
+        for token in self.doc_tokens(cls, values):
+            self.add_token(token, doc)
+
+    def drop_category(self, category):
+        # Документы категории выбрасываются, а оставшиеся перенумеровываются подряд,
+        # чтобы каждая переиндексация (замена списка товаров) не копила пустые места в docs
+        renumber = {}
+        docs = []
+        for doc, entry in enumerate(self.docs):
+            if entry[0] is not category:
+                renumber[doc] = len(docs)
+                docs.append(entry)
+        self.docs = docs
+        for token, postings in self.postings.items():
+            self.postings[token] = {renumber[doc] for doc in postings if doc in renumber}
+        product_docs = {}
+        for key, owned in self.product_docs.items():
+            owned = [renumber[doc] for doc in owned if doc in renumber]
+            if owned:
+                product_docs[key] = owned
+        self.product_docs = product_docs
+
+    def sync(self):
+        # Снимки берутся без self.lock: писатель держит блокировку категории и ждёт self.lock в on_change
+        with self.lock:
+            categories = list(self.categories)
+        snapshots = [(category, category.snapshot()) for category in categories]
+        with self.lock:
+            for category, snapshot in snapshots:
+                state = self.categories.get(category)
+                if state is None or state[0] is not None and snapshot.generation < state[0]:
+                    continue
+                if state[0] != snapshot.generation:
+                    if state[0] is not None:
+                        self.drop_category(category)
+                    state[:] = [snapshot.generation, snapshot.storage, 0]
+                # Параллельный sync мог уже проиндексировать эти позиции по более свежему снимку
+                for position in range(state[2], snapshot.count):
+                    self.index_position(category, snapshot.storage, position)
+                state[2] = max(state[2], snapshot.count)
+
+    def on_change(self, product, field, old, new):
+        # Товар может лежать в нескольких подключённых категориях; повторный вызов ничего не меняет
+        with self.lock:
+            docs = self.product_docs.get(id(product))
+            if not docs or field not in self.fields_of(type(product)):
+                return
+            values = {name: getattr(product, name) for name in self.fields_of(type(product))}
+            new_tokens = self.doc_tokens(type(product), values)
+            values[field] = old
+            old_tokens = self.doc_tokens(type(product), values)
+            for doc in docs:
+                for token in old_tokens - new_tokens:
+                    self.remove_token(token, doc)
+                for token in new_tokens - old_tokens:
+                    self.add_token(token, doc)
+
+    def prefix_tokens(self, prefix, limit):
+        tokens = []
+        i = bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and len(tokens) < limit and self.vocabulary[i].startswith(prefix):
+            tokens.append(self.vocabulary[i])
+            i += 1
+        tokens.extend(token for token in self.recent if token.startswith(prefix))
+        return tokens[:limit]
+
+    def fuzzy_tokens(self, token, limit, threshold):
+        # Похожие слова по доле общих триграмм (коэффициент Жаккара)
+        query = trigrams(token)
+        shared = Counter()
+        for trigram in query:
+            shared.update(self.trigram_tokens.get(trigram, ()))
+        scored = []
+        for candidate, count in shared.items():
+            score = count / (len(query) + len(trigrams(candidate)) - count)
+            if score >= threshold:
+                scored.append((score, candidate))
+        scored.sort(reverse=True)
+        return [candidate for _, candidate in scored[:limit]]
+
+    def term_tokens(self, term, prefix, fuzzy, expansions, threshold):
+        tokens = [term] if self.postings.get(term) else []
+        if prefix:
+            tokens += [token for token in self.prefix_tokens(term, expansions) if token != term]
+        if not tokens and fuzzy:
+            tokens = self.fuzzy_tokens(term, expansions, threshold)
+        return [token for token in tokens if self.postings.get(token)]
+
+    def search(self, query, limit=20, prefix=True, fuzzy=True, expansions=50, threshold=0.4):
+        # Все слова запроса должны найтись (И); последнее слово дополняется как префикс,
+        # слова без точного совпадения ищутся по триграммам. Перебор идёт по самому
+        # редкому слову и останавливается, набрав limit товаров
+        self.sync()
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self.lock:
+            return [self.product(doc) for doc in self.match(terms, limit, prefix, fuzzy, expansions, threshold)]
+
+    def match(self, terms, limit, prefix, fuzzy, expansions, threshold):
+        matches = [self.term_tokens(term, prefix and i == len(terms) - 1, fuzzy, expansions, threshold)
+                   for i, term in enumerate(terms)]
+        if not all(matches):
+            return []
+        sets = [[self.postings[token] for token in tokens] for tokens in matches]
+        sets.sort(key=lambda postings: sum(map(len, postings)))
+        driver, others = sets[0], sets[1:]
+        found = []
+        seen = set()
+        for postings in driver:
+            for doc in postings:
+                if doc in seen:
+                    continue
+                seen.add(doc)
+                if all(any(doc in docs for docs in other) for other in others):
+                    found.append(doc)
+                    if len(found) >= limit:
+                        break
+            if len(found) >= limit:
+                break
+        found.sort()
+        return found
+
+    def product(self, doc):
+        _, storage, position = self.docs[doc]
+        return storage[position]
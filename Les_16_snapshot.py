@@ -0,0 +1,128 @@
+import json
+import mmap
+import struct
+
+from Les_16_hmw import MISSING, Category, LawnGrass, Product, ProductColumns, Smartphone, to_kopecks
+
+MAGIC = b"L16S"
+VERSION = 3
+HEADER = struct.Struct("<4sII")
+# Код класса, признак целой цены, цена в копейках, остаток, номер названия, номер описания,
+# номер доп. полей. Копейки - целое число: double терял бы int-цены больше 2**53
+ROW = struct.Struct("<BBqqIIi")
+OFFSET = struct.Struct("<Q")
+PRODUCT_CLASSES = {cls.__name__: cls for cls in (Product, Smartphone, LawnGrass)}
+
+
+def save_snapshot(category, path):
+    # Файл: заголовок, JSON с итогами и справочниками, строки товаров фиксированной длины,
+    # таблица смещений строк и сами строки в UTF-8
+    classes = []
+    strings = {}
+    extras = {}
+    rows = bytearray()
+
+    def string_id(value):
+        return strings.setdefault(value, len(strings))
+
+    for cls, record in category.iter_records():
+        if cls not in classes:
+            classes.append(cls)
+        extra = list(record[4:])
+        extra_id = extras.setdefault(tuple(extra), len(extras)) if extra else -1
+        try:
+            rows += ROW.pack(classes.index(cls), type(record[2]) is int, to_kopecks(record[2]), record[3],
+                             string_id(record[0]), string_id(record[1]), extra_id)
+        except struct.error:
+            raise ValueError(f"Цена или остаток товара {record[0]!r} не помещаются в снимок") from None
+
+    quantity_total, price_total, value_total, float_prices, type_totals = category._totals()
+    meta = json.dumps({
+        "name": category.name,
+        "description": category.description,
+        "count": len(rows) // ROW.size,
+        "classes": [cls.__name__ for cls in classes],
+        "extras": [list(extra) for extra in extras],
+        "strings": len(strings),
+        "totals": [quantity_total, price_total, value_total, float_prices],
+        "type_totals": {cls.__name__: [value, float_seen] for cls, (value, float_seen) in type_totals.items()}
+    }, ensure_ascii=False).encode("utf-8")
+
+    encoded = [value.encode("utf-8") for value in strings]
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(meta)))
+        file.write(meta)
+        file.write(rows)
+        offset = 0
+        for value in encoded:
+            file.write(OFFSET.pack(offset))
+            offset += len(value)
+        file.write(OFFSET.pack(offset))
+        for value in encoded:
+            file.write(value)
+
+
+class MappedProducts(ProductColumns):
+    # Товары из снимка читаются прямо из отображённого в память файла и собираются по запросу.
+    # Добавленные после загрузки товары хранятся в обычных колонках родительского класса
+    def __init__(self, path, meta, classes):
+        super().__init__()
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mapped_classes = [classes[name] for name in meta["classes"]]
+        self.mapped_extras = [tuple(extra) for extra in meta["extras"]]
+        self.mapped_count = meta["count"]
+        self.rows_offset = HEADER.size + meta["meta_size"]
+        self.offsets_offset = self.rows_offset + self.mapped_count * ROW.size
+        self.strings_offset = self.offsets_offset + (meta["strings"] + 1) * OFFSET.size
+
+    def __len__(self):
+        return self.mapped_count + len(self.prices)
+
+    def __string(self, string_id):
+        start, = OFFSET.unpack_from(self.map, self.offsets_offset + string_id * OFFSET.size)
+        end, = OFFSET.unpack_from(self.map, self.offsets_offset + (string_id + 1) * OFFSET.size)
+        return str(self.map[self.strings_offset + start:self.strings_offset + end], "utf-8")
+
+    def record_at(self, index):
+        if index >= self.mapped_count:
+            return super().record_at(index - self.mapped_count)
+        code, int_price, kopecks, quantity, name_id, description_id, extra_id = ROW.unpack_from(
+            self.map, self.rows_offset + index * ROW.size)
+        extra = self.mapped_extras[extra_id] if extra_id >= 0 else ()
+        # float-цена уже округлена до копеек, поэтому деление возвращает то же значение
+        price = kopecks // 100 if int_price else kopecks / 100
+        return self.mapped_classes[code], (self.__string(name_id), self.__string(description_id),
+                                           price, quantity) + extra
+
+    def price_at(self, index):
+        if index >= self.mapped_count:
+            return super().price_at(index - self.mapped_count)
+        return self.record_at(index)[1][2]
+
+    def value_at(self, index, field):
+        if index >= self.mapped_count:
+            return super().value_at(index - self.mapped_count, field)
+        cls, record = self.record_at(index)
+        if field not in cls.fields:
+            return MISSING
+        return record[cls.fields.index(field)]
+
+    def close(self):
+        self.map.close()
+
+
+def load_snapshot(path, classes=None):
+    classes = classes or PRODUCT_CLASSES
+    with open(path, "rb") as file:
+        magic, version, meta_size = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Файл {path} не является снимком категории")
+        meta = json.loads(file.read(meta_size).decode("utf-8"))
+    meta["meta_size"] = meta_size
+    # Итоги в снимке хранятся в целых копейках
+    quantity_total, price_total, value_total, float_prices = meta["totals"]
+    totals = (quantity_total, price_total, value_total, float_prices,
+              {classes[name]: [value, float_seen] for name, (value, float_seen) in meta["type_totals"].items()})
+    storage = MappedProducts(path, meta, classes)
+    return Category._restore(meta["name"], meta["description"], storage, totals)